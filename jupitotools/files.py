@@ -3,14 +3,22 @@
 # TODO: (?) https://github.com/jaraco/path.py
 
 import errno
+import fnmatch
 import logging
+import mmap
 import os
+import pickle
+import re
 import shutil
 import sys
 import tempfile
 from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain, islice
 from pathlib import Path, PosixPath
+from stat import S_ISDIR
 
 # # Try to use newer version of pathlib, if available.
 # try:
@@ -87,6 +95,112 @@ class XAttrStr(XAttr):
         super().__setitem__(key, value.encode('utf-8'))
 
 
+class XAttrCache(XAttr):
+    """XAttr that reads all attributes at once and caches them.
+
+    Listing and reading is done from a snapshot taken on creation and on
+    `refresh()`. Writing is done immediately, and updates the snapshot.
+    """
+
+    def __init__(self, path, follow_symlinks=True):
+        """Init and read attributes."""
+        super().__init__(path, follow_symlinks=follow_symlinks)
+        self._cache = {}
+        self.refresh()
+
+    def refresh(self):
+        """Read all attributes again."""
+        cache = {}
+        for key in self._wrapper(os.listxattr):
+            try:
+                cache[key] = self._wrapper(os.getxattr, key)
+            except KeyError:
+                pass  # Removed meanwhile.
+        self._cache = cache
+        return self
+
+    def _list(self):
+        return list(self._cache)
+
+    def __getitem__(self, key):
+        return self._cache[key]
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._cache[key] = value
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._cache.pop(key, None)
+
+    def __iter__(self):
+        return iter(self._list())
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+
+class XAttrStrCache(XAttrStr, XAttrCache):
+    """XAttrCache for strings."""
+
+
+def _read_xattrs(path, prefix=None, follow_symlinks=False):
+    """Read extended attributes of path as dict, or None if there are none."""
+    try:
+        keys = os.listxattr(path, follow_symlinks=follow_symlinks)
+    except OSError as e:
+        logging.debug('Cannot list attributes: %s: %s', path, e)
+        return None
+    if prefix is not None:
+        keys = [x for x in keys if x.startswith(prefix)]
+    d = {}
+    for key in keys:
+        try:
+            d[key] = os.getxattr(path, key, follow_symlinks=follow_symlinks)
+        except OSError as e:
+            logging.debug('Cannot read attribute: %s: %s: %s', path, key, e)
+    return d or None
+
+
+def _walk_paths(path, follow_symlinks=False):
+    """Yield path strings in a directory tree, excluding root, by scandir."""
+    stack = [os.fspath(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    yield entry.path
+                    if entry.is_dir(follow_symlinks=follow_symlinks):
+                        stack.append(entry.path)
+        except OSError as e:
+            logging.debug('Cannot scan directory: %s', e)
+
+
+def xattr_tree(path, prefix=None, follow_symlinks=False, workers=None,
+               batch_size=256):
+    """Read extended attributes of a whole directory tree.
+
+    The tree is walked with `os.scandir()`, and attributes are read in a
+    thread pool, in batches of paths. Only keys starting with `prefix` are
+    read, if given, e.g. 'user.'. Return a dict of path strings to dicts of
+    attributes, for paths that have any; the root itself included.
+    """
+    def read_batch(paths):
+        return [(x, _read_xattrs(x, prefix=prefix,
+                                 follow_symlinks=follow_symlinks))
+                for x in paths]
+
+    paths = _walk_paths(path, follow_symlinks=follow_symlinks)
+    batches = iter(lambda: list(islice(paths, batch_size)), [])
+    batches = chain([[os.fspath(path)]], batches)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(read_batch, batches)
+        return {k: v for batch in results for k, v in batch if v}
+
+
 class ExtPath(PosixPath):
     """PosixPath extended for convenience."""
 
@@ -124,8 +238,9 @@ class ExtPath(PosixPath):
 
     def trash(self):
         """Send to trash."""
-        # pylint: disable=import-outside-toplevel
-        from send2trash import send2trash
+        send2trash = _get_send2trash()
+        if send2trash is None:
+            raise ImportError('send2trash not available')
         logging.debug('Sending to trash: %s', self)
         send2trash(os.fspath(self))
 
@@ -180,21 +295,94 @@ def temp_dir(**kwargs):
             pass
 
 
+FICLONE = 0x40049409  # From linux/fs.h.
+
+
+def reflink(src, dst):
+    """Make dst a copy-on-write clone of src (Btrfs, XFS, ...).
+
+    Raise OSError if not supported.
+    """
+    # pylint: disable=import-outside-toplevel
+    import fcntl
+    with open(src, 'rb') as i, open(dst, 'wb') as o:
+        try:
+            fcntl.ioctl(o.fileno(), FICLONE, i.fileno())
+        except OSError:
+            o.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def backup_file(src, dst):
+    """Back up src as dst without copying data, if possible.
+
+    Try a hard link first (fine when src is going to be replaced, not
+    modified), then a reflink, and finally a full copy.
+    """
+    src, dst = os.fspath(src), os.fspath(dst)
+    try:
+        os.remove(dst)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+        return
+    except OSError as e:
+        logging.debug('Cannot hard link: %s: %s', src, e)
+    try:
+        reflink(src, dst)
+        return
+    except OSError as e:
+        logging.debug('Cannot reflink: %s: %s', src, e)
+    shutil.copy2(src, dst)
+
+
+def fsync_dir(path):
+    """Flush directory entries to disk."""
+    fd = os.open(os.fspath(path), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 @contextmanager
-def tempfile_and_backup(path, mode, bakext='.bak', **kwargs):
-    """Create a temporary file for writing, do backup, replace destination."""
+def tempfile_and_backup(path, mode, bakext='.bak', inplace=False, **kwargs):
+    """Create a temporary file for writing, do backup, replace destination.
+
+    With `inplace`, the temporary file is created in the destination
+    directory, and the old file's permissions are kept. The backup is done by
+    `backup_file()`, and the destination is replaced atomically by
+    `os.replace()`, after syncing the file; the directory is synced
+    afterwards. This way only the new data is written.
+    """
     path = Path(path)
     if path.exists() and not path.is_file():
         raise IOError('Not a regular file: {}'.format(path))
         # raise IOError(f'Not a regular file: {path}')
+    if inplace:
+        kwargs.setdefault('dir', path.parent)
+        kwargs.setdefault('prefix', '.{}.'.format(path.name))
     with tempfile.NamedTemporaryFile(mode=mode, delete=False, **kwargs) as fp:
         try:
             yield fp
+            if inplace:
+                fp.flush()
+                os.fsync(fp.fileno())
             fp.close()
-            if path.exists():
-                shutil.copy2(os.fspath(path),
-                             os.fspath(path.with_suffix(bakext)))
-            shutil.move(fp.name, os.fspath(path))
+            if inplace:
+                if path.exists():
+                    os.chmod(fp.name, path.stat().st_mode & 0o7777)
+                    backup_file(path, path.with_suffix(bakext))
+                os.replace(fp.name, os.fspath(path))
+                fsync_dir(path.parent)
+            else:
+                if path.exists():
+                    shutil.copy2(os.fspath(path),
+                                 os.fspath(path.with_suffix(bakext)))
+                shutil.move(fp.name, os.fspath(path))
         finally:
             fp.close()
             if os.path.exists(fp.name):
@@ -218,6 +406,161 @@ def valid_lines(*paths, sanitizer=sanitize_line):
             yield from filter(None, (sanitizer(x) for x in fp))
 
 
+def scan_files(paths, glob='*'):
+    """Get file paths and stats: explicitly given files, or expanded dirs.
+
+    Each directory is listed in a single `os.scandir()` pass, its matching
+    files sorted by name. Yield `(path, stat_result)` pairs.
+    """
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            with os.scandir(path) as it:
+                entries = sorted((x for x in it if x.is_file() and
+                                  fnmatch.fnmatchcase(x.name, glob)),
+                                 key=lambda x: x.name)
+            for entry in entries:
+                yield path / entry.name, entry.stat()
+        else:
+            yield path, path.stat()
+
+
+class FileCache:
+    """Persistent cache of per-file results, such as parsed file contents.
+
+    An entry is valid as long as the file's `(mtime_ns, size)` stay the same.
+    The cache is stored as a pickle, and rewritten atomically on `save()` if
+    anything changed. Entries of files not looked up are kept, as long as
+    the files exist. A missing, unreadable, or outdated cache file is
+    silently ignored; bump `version` when the format of cached values
+    changes.
+    """
+
+    def __init__(self, path, version=1):
+        """Init and load."""
+        self.path = Path(path)
+        self.version = version
+        self.entries = {}
+        self.seen = set()
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        """Load cache file."""
+        # pylint: disable=broad-except
+        try:
+            with self.path.open('rb') as fp:
+                version, entries = pickle.load(fp)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.debug('Ignoring cache %s: %s', self.path, e)
+            return
+        if version == self.version:
+            self.entries = entries
+
+    def get(self, path, stat, func):
+        """Return cached `func(path)`, calling it if file has changed."""
+        key = os.fspath(path)
+        signature = stat.st_mtime_ns, stat.st_size
+        self.seen.add(key)
+        try:
+            cached_signature, value = self.entries[key]
+        except KeyError:
+            pass
+        else:
+            if cached_signature == signature:
+                return value
+        value = func(path)
+        self.entries[key] = signature, value
+        self.dirty = True
+        return value
+
+    def save(self):
+        """Save cache file if changed."""
+        gone = {x for x in self.entries
+                if x not in self.seen and not os.path.exists(x)}
+        if not self.dirty and not gone:
+            return
+        entries = {k: v for k, v in self.entries.items() if k not in gone}
+        try:
+            ensure_dir(self.path)
+            with tempfile.NamedTemporaryFile(dir=self.path.parent,
+                                             prefix=self.path.name,
+                                             delete=False) as fp:
+                try:
+                    pickle.dump((self.version, entries), fp)
+                    fp.close()
+                    os.replace(fp.name, self.path)
+                finally:
+                    if os.path.exists(fp.name):
+                        os.remove(fp.name)
+        except OSError as e:
+            logging.warning('Cannot save cache %s: %s', self.path, e)
+            return
+        self.entries = entries
+        self.dirty = False
+
+
+def _mmap_chunks(path, size=2**20):
+    """Memory-map file, yield chunks of about `size` bytes ending at newlines.
+
+    A chunk may end between `\r` and `\n`, leaving an empty line.
+    """
+    with open(path, 'rb') as fp:
+        if not os.fstat(fp.fileno()).st_size:
+            return  # Empty files cannot be mapped.
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos, end = 0, len(mm)
+            while pos < end:
+                stop = max(mm.rfind(b'\n', pos, pos + size),
+                           mm.rfind(b'\r', pos, pos + size)) + 1
+                if stop <= pos:
+                    # No newline within size, take a longer line whole.
+                    found = [x for x in (mm.find(b'\n', pos + size),
+                                         mm.find(b'\r', pos + size))
+                             if x >= 0]
+                    stop = min(found) + 1 if found else end
+                yield mm[pos:stop]
+                pos = stop
+
+
+def valid_lines_mmap(*paths, commenter='#', encoding='utf-8',
+                     batch_size=None):
+    """Fast version of `valid_lines()` for very large files.
+
+    Files are memory-mapped and processed in chunks of many lines at a time:
+    comments are cut out of the bytes, and the rest is decoded, split, and
+    stripped without per-line Python code. Yield lines, or lists of up to
+    `batch_size` lines if given. With `encoding=None`, lines are bytes, and
+    only ASCII whitespace is stripped. The encoding must be ASCII compatible.
+    Lines may end with `\n`, `\r\n`, or `\r`, like universal newlines.
+    """
+    bcommenter = commenter.encode('ascii')
+    comment = re.compile(re.escape(bcommenter) + rb'[^\r\n]*')
+    batch = []
+    for path in paths:
+        for chunk in _mmap_chunks(path):
+            if bcommenter in chunk:
+                chunk = comment.sub(b'', chunk)
+            if b'\r' in chunk:
+                chunk = chunk.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+            if encoding is None:
+                lines = filter(None, map(bytes.strip, chunk.split(b'\n')))
+            else:
+                lines = filter(None, map(str.strip,
+                                         chunk.decode(encoding).split('\n')))
+            if batch_size is None:
+                yield from lines
+                continue
+            batch.extend(lines)
+            while len(batch) >= batch_size:
+                yield batch[:batch_size]
+                del batch[:batch_size]
+    if batch:
+        yield batch
+
+
 def copy_times(src, dst):
     """Copy atime and mtime from src to dst, following symlinks."""
     src = os.fspath(src)
@@ -235,15 +578,164 @@ def move(src, dst):
     return shutil.move(os.fspath(src), os.fspath(dst))
 
 
+@lru_cache(maxsize=None)
+def _get_send2trash():
+    """Import send2trash once. Return the function, or None if unavailable."""
+    try:
+        # pylint: disable=import-outside-toplevel
+        from send2trash import send2trash
+    except ImportError:
+        return None
+    return send2trash
+
+
+class RemovalPlan:
+    """What removing some paths recursively would remove.
+
+    Made by `plan_removal()`. Files (anything but directories) are grouped by
+    their directory in `batches` of `(dirpath, names, nbytes)`; directories
+    to remove are listed in `dirs`, parents before children.
+    """
+
+    def __init__(self):
+        """Init."""
+        self.batches = []
+        self.dirs = []
+        self.nfiles = 0
+        self.nbytes = 0
+
+    def add_files(self, dirpath, names, nbytes):
+        """Add file names in a directory."""
+        if names:
+            self.batches.append((dirpath, names, nbytes))
+            self.nfiles += len(names)
+            self.nbytes += nbytes
+
+    def __str__(self):
+        return '{} files, {} directories, {} bytes'.format(
+            self.nfiles, len(self.dirs), self.nbytes)
+
+
+def _plan_dirs(plan, stack, batch_size):
+    """Walk directories in stack, adding their contents to plan."""
+    while stack:
+        dirpath = stack.pop()
+        plan.dirs.append(dirpath)
+        names, nbytes = [], 0
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    names.append(entry.name)
+                    try:
+                        nbytes += entry.stat(follow_symlinks=False).st_size
+                    except FileNotFoundError:
+                        pass
+                    if len(names) == batch_size:
+                        plan.add_files(dirpath, names, nbytes)
+                        names, nbytes = [], 0
+        except FileNotFoundError:
+            continue
+        plan.add_files(dirpath, names, nbytes)
+
+
+def plan_removal(paths, batch_size=1024):
+    """Walk paths once with `os.scandir()`, return a RemovalPlan.
+
+    Symlinks are not followed, and nonexistent paths are ignored. Files in a
+    directory are split into batches of at most `batch_size` names.
+    """
+    plan = RemovalPlan()
+    stack = []
+    for path in paths:
+        path = os.fspath(path)
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            continue
+        if S_ISDIR(st.st_mode):
+            stack.append(path)
+        else:
+            dirpath, name = os.path.split(os.path.abspath(path))
+            plan.add_files(dirpath, [name], st.st_size)
+    _plan_dirs(plan, stack, batch_size)
+    return plan
+
+
+def _unlink_batch(dirpath, names):
+    """Unlink names relative to an open directory. Return number removed."""
+    n = 0
+    fd = os.open(dirpath, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for name in names:
+            try:
+                os.unlink(name, dir_fd=fd)
+                n += 1
+            except FileNotFoundError:
+                pass
+    finally:
+        os.close(fd)
+    return n
+
+
+def execute_removal(plan, workers=8, callback=None):
+    """Remove what a RemovalPlan lists.
+
+    File batches are unlinked in a thread pool, then directories are removed
+    children first. If given, `callback(nfiles, nbytes)` is called with the
+    running totals after each batch.
+    """
+    nfiles = nbytes = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_unlink_batch, d, names): size
+                   for d, names, size in plan.batches}
+        for future in as_completed(futures):
+            nfiles += future.result()
+            nbytes += futures[future]
+            if callback is not None:
+                callback(nfiles, nbytes)
+    for dirpath in reversed(plan.dirs):
+        try:
+            os.rmdir(dirpath)
+        except FileNotFoundError:
+            pass
+
+
+def rm_rf_many(paths, workers=8, callback=None, dry_run=False):
+    """Recursively remove paths, if they exist. Return the RemovalPlan.
+
+    See `plan_removal()` and `execute_removal()`. With `dry_run`, only plan.
+    """
+    plan = plan_removal(paths)
+    logging.debug('Removing: %s', plan)
+    if not dry_run:
+        execute_removal(plan, workers=workers, callback=callback)
+    return plan
+
+
+def trash_or_rm_many(paths, workers=8, callback=None):
+    """Send paths to trash if possible, otherwise remove them recursively.
+
+    Return None if trashed, otherwise the RemovalPlan.
+    """
+    paths = [os.fspath(x) for x in paths]
+    send2trash = _get_send2trash()
+    if send2trash is None:
+        return rm_rf_many(paths, workers=workers, callback=callback)
+    logging.debug('Sending to trash: %s paths', len(paths))
+    try:
+        send2trash(paths)  # Newer versions take a list.
+    except TypeError:
+        for path in paths:
+            send2trash(path)
+    return None
+
+
 def rm_rf(path):
     """Recursively remove path, whatever it is, if it exists. Like rm -rf."""
-    path = os.fspath(path)
-    if os.path.exists(path):
-        logging.debug('Removing: %s', format(path))
-        if os.path.isdir(path):
-            shutil.rmtree(path)
-        else:
-            os.remove(path)
+    rm_rf_many([path])
 
 
 def abbreviate_path(path):
@@ -0,0 +1,204 @@
+"""Content hashes stored in extended attributes, and duplicate detection.
+
+A file's hash is stored in the xattr `user.jupitotools.<algorithm>` as
+`'<mtime_ns> <size> <hexdigest>'`. It is trusted as long as the file's
+modification time and size stay the same, so unchanged files are never read
+again. Writing an xattr does not touch the modification time.
+"""
+
+import hashlib
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from stat import S_ISDIR, S_ISREG
+
+import click
+
+from .files import XAttrStr
+
+ALGORITHM = 'sha256'
+XATTR_PREFIX = 'user.jupitotools.'
+BUFSIZE = 2**20
+PREHASH_SIZE = 2**16  # Bytes read from both head and tail for prehash.
+
+
+def xattr_key(algorithm=ALGORITHM):
+    """Return the xattr key for a hash algorithm."""
+    return XATTR_PREFIX + algorithm
+
+
+def stored_hash(path, stat=None, algorithm=ALGORITHM):
+    """Return stored hexdigest, or None if missing or outdated."""
+    if stat is None:
+        stat = os.stat(path)
+    try:
+        value = XAttrStr(path)[xattr_key(algorithm)]
+        mtime_ns, size, digest = value.split()
+    except (KeyError, OSError, UnicodeDecodeError, ValueError):
+        return None
+    if (mtime_ns, size) != (str(stat.st_mtime_ns), str(stat.st_size)):
+        return None
+    return digest
+
+
+def store_hash(path, stat, digest, algorithm=ALGORITHM):
+    """Store hexdigest; failure (e.g. read-only filesystem) is only logged."""
+    value = '{} {} {}'.format(stat.st_mtime_ns, stat.st_size, digest)
+    try:
+        XAttrStr(path)[xattr_key(algorithm)] = value
+    except OSError as e:
+        logging.debug('Cannot store hash: %s: %s', path, e)
+
+
+def compute_hash(path, algorithm=ALGORITHM):
+    """Read file and return its hexdigest."""
+    h = hashlib.new(algorithm)
+    buf = bytearray(BUFSIZE)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as fp:
+        for n in iter(lambda: fp.readinto(buf), 0):
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def content_hash(path, algorithm=ALGORITHM, store=True):
+    """Return file's hexdigest, using and updating the stored one."""
+    stat = os.stat(path)
+    digest = stored_hash(path, stat, algorithm=algorithm)
+    if digest is None:
+        digest = compute_hash(path, algorithm=algorithm)
+        # Don't store if the file was modified while reading.
+        if store and os.stat(path).st_mtime_ns == stat.st_mtime_ns:
+            store_hash(path, stat, digest, algorithm=algorithm)
+    return digest
+
+
+def prehash(path, size=PREHASH_SIZE):
+    """Return a cheap hash of file's head and tail."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb', buffering=0) as fp:
+        h.update(fp.read(size))
+        fp.seek(-size, os.SEEK_END)
+        h.update(fp.read(size))
+    return h.digest()
+
+
+def _prehash_job(path):
+    """Process pool job: return path and its prehash, or None on error."""
+    try:
+        return path, prehash(path)
+    except OSError as e:
+        logging.warning('Cannot read: %s: %s', path, e)
+        return path, None
+
+
+def _hash_job(args):
+    """Process pool job: return path and its hash, or None on error."""
+    path, algorithm, store = args
+    try:
+        return path, content_hash(path, algorithm=algorithm, store=store)
+    except OSError as e:
+        logging.warning('Cannot read: %s: %s', path, e)
+        return path, None
+
+
+def walk_files(paths):
+    """Yield `(path, stat_result)` of regular files in directory trees.
+
+    Symlinks are not followed. Each hard-linked file is yielded only once.
+    """
+    seen = set()
+    stack = [os.fspath(x) for x in reversed(paths)]
+    while stack:
+        path = stack.pop()
+        try:
+            stat = os.stat(path, follow_symlinks=False)
+            if S_ISDIR(stat.st_mode):
+                with os.scandir(path) as it:
+                    entries = sorted((x.path for x in it), reverse=True)
+                stack.extend(entries)
+                continue
+        except OSError as e:
+            logging.warning('Cannot scan: %s: %s', path, e)
+            continue
+        inode = (stat.st_dev, stat.st_ino)
+        if S_ISREG(stat.st_mode) and inode not in seen:
+            seen.add(inode)
+            yield path, stat
+
+
+def _groups(pairs):
+    """Group paths by key, return only the groups with several paths."""
+    d = defaultdict(list)
+    for path, key in pairs:
+        if key is not None:
+            d[key].append(path)
+    return [x for x in d.values() if len(x) > 1]
+
+
+def find_dupes(paths, algorithm=ALGORITHM, min_size=1, store=True,
+               workers=None):
+    """Find groups of files with identical contents.
+
+    Files are first grouped by size, and only files of colliding sizes are
+    looked at further. Stored hashes are used where valid; other files are
+    first compared by a head/tail prehash when that is cheaper than reading
+    the whole file, and only then fully hashed. Reading is done in a process
+    pool. Return a sorted list of sorted path lists.
+    """
+    stats = {p: s for p, s in walk_files(paths) if s.st_size >= min_size}
+    known = []  # Pairs of (path, (size, digest)).
+    todo = []  # Paths to be hashed.
+    unknown = []  # Paths to be prehashed first.
+    for group in _groups((p, s.st_size) for p, s in stats.items()):
+        missing = []
+        for path in group:
+            digest = stored_hash(path, stats[path], algorithm=algorithm)
+            if digest is None:
+                missing.append(path)
+            else:
+                known.append((path, (stats[path].st_size, digest)))
+        # Prehash can only rule out files when nothing is known of the others.
+        if (len(missing) == len(group) and
+                stats[group[0]].st_size > 2 * PREHASH_SIZE):
+            unknown.extend(missing)
+        else:
+            todo.extend(missing)
+    if not todo and not unknown:
+        return sorted(sorted(x) for x in _groups(known))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pairs = executor.map(_prehash_job, unknown, chunksize=16)
+        # Prehashes of files of different sizes may not be mixed.
+        for group in _groups((x, (stats[x].st_size, h)) for x, h in pairs
+                             if h is not None):
+            todo.extend(group)
+        jobs = [(x, algorithm, store) for x in todo]
+        pairs = executor.map(_hash_job, jobs, chunksize=4)
+        known.extend((x, (stats[x].st_size, h)) for x, h in pairs
+                     if h is not None)
+    return sorted(sorted(x) for x in _groups(known))
+
+
+@click.command()
+@click.argument('paths', nargs=-1, type=click.Path(exists=True), required=True)
+@click.option('-a', '--algorithm', default=ALGORITHM, show_default=True,
+              type=click.Choice(sorted(x for x in
+                                       hashlib.algorithms_guaranteed
+                                       if not x.startswith('shake_'))),
+              help='Hash algorithm')
+@click.option('-m', '--min-size', type=int, default=1, show_default=True,
+              help='Ignore smaller files')
+@click.option('-j', '--jobs', type=int, help='Number of worker processes')
+@click.option('--store/--no-store', default=True, show_default=True,
+              help='Store computed hashes in extended attributes')
+def cli_find_dupes(paths, algorithm, min_size, jobs, store):
+    """Find duplicate files, print them in groups separated by empty lines."""
+    groups = find_dupes([Path(x) for x in paths], algorithm=algorithm,
+                        min_size=min_size, store=store, workers=jobs)
+    for i, group in enumerate(groups):
+        if i:
+            print()
+        for path in group:
+            print(path)
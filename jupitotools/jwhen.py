@@ -5,13 +5,18 @@
 # https://nedbatchelder.com/blog/201206/eval_really_is_dangerous.html
 # http://newville.github.io/asteval/
 
+import ast
+import functools
+import logging
+import operator
 from pathlib import Path
 import re
 
 import click
 
-from .files import valid_lines
-from .time import Date
+from .files import FileCache, scan_files, valid_lines
+from .time import (FEASTS, Date, date_fields, feasts,
+                   fill_feast_tables)
 
 # From when(1) manual (http://www.lightandmatter.com/when/when.html):
 #     w - day of the week
@@ -32,6 +37,9 @@ DEFAULT_FORMATS = dict(
     date_weekname='%m-%d %V~%a',
     )
 
+CACHE_NAME = 'cache.pickle'
+CACHE_VERSION = 4  # Bump when the cached `Rule` changes.
+
 # ~/.config/jwhen/test.jwhen
 
 
@@ -103,35 +111,28 @@ class JWhen:
     def _getitem_fallback(self, key):
         if key in self.__dict__:
             return self.__dict__[key]
+        if key in FEASTS:
+            # Movable feast names are true on their day, e.g. `pentecost`.
+            return self.today == feasts(self.today.year)[key]
         if key.capitalize() in 'Mon Tue Wed Thu Fri Sat Sun'.split():
             return key.capitalize()
         return None
 
     def eval(self, s):
         """Evaluate expression."""
-        # pylint: disable=eval-used
-        try:
-            res = parse_date_string(s)
-            print('###', s, res)
-            d = dict(zip('year month day'.split(), res))
-            print('###', s, d)
-            res = self.today == self.today.replace(**d)
-            return res
-        except ValueError:
-            # res = parse_date_exp(s)
-            pass
-        if s[0] == '=':
-            res = self.today.fromisoformat(s[1:])
-        elif s[0] == '*':
-            _, m, d = s.split()
-            res = self.today.replace(month=int(m), day=int(d))
+        return self.eval_rule(Rule(s, None))
+
+    def eval_rule(self, rule):
+        """Evaluate a compiled rule."""
+        if rule.kind == 'ymd':
+            res = self.today == self.today.replace(**rule.value)
+        elif rule.kind == 'iso':
+            res = rule.value
+        elif rule.kind == 'md':
+            res = self.today.replace(**rule.value)
         else:
-            res = eval(s, dict(__builtins__=None), self)
-            # try:
-            #     res = eval(s, dict(__builtins__=None), self)
-            # except SyntaxError:
-            #     res = self.today.parse(s)
-        self.exp = s
+            res = rule.value(self)
+        self.exp = rule.exp
         self.res = res
         # if isinstance(res, (tuple, list)):
         #     m, d = [int(x) for x in res]
@@ -143,6 +144,529 @@ class JWhen:
         return res
 
 
+class ExprCompiler:
+    """Compile a when(1)-style expression into closures, without `eval()`.
+
+    The grammar is a safe subset of Python expressions: key names, constants,
+    tuples, lists, sets, subscripts, comparisons, arithmetic, conditional
+    expressions, `and`/`or`/`not`, calls of keys like `wk_of(12, 24)`, and
+    public attributes. As in when(1), `&`, `|`, and `!`
+    are the logical and, or, and not, with lower precedence than comparisons,
+    so `!workday & m==6` means `(not workday) and (m == 6)`. Anything else is
+    rejected with ValueError.
+
+    In scalar mode the closures take a `JWhen`, with key getters bound at
+    compile time; in vector mode they take `JWhenColumns` and combine boolean
+    subexpressions elementwise.
+    """
+    # Relative cost of reading a key in `JWhen`, for reordering conjunctions
+    # of comparisons so that cheap tests are done first. Only integer keys.
+    KEY_COSTS = dict(y=1, m=1, d=1, wd=2, gd=2, a=2, yd=3, wk=3, wy=3, pd=3,
+                     b=4, until_easter=4)
+    BOOL_KEYS = ('workday',) + FEASTS
+    BINOPS = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Div: operator.truediv,
+        ast.FloorDiv: operator.floordiv,
+        ast.Mod: operator.mod,
+        ast.Pow: operator.pow,
+        ast.BitXor: operator.xor,
+        }
+    CMPOPS = {
+        ast.Eq: operator.eq,
+        ast.NotEq: operator.ne,
+        ast.Lt: operator.lt,
+        ast.LtE: operator.le,
+        ast.Gt: operator.gt,
+        ast.GtE: operator.ge,
+        ast.Is: operator.is_,
+        ast.IsNot: operator.is_not,
+        ast.In: lambda a, b: a in b,
+        ast.NotIn: lambda a, b: a not in b,
+        }
+    # For lexicographic tuple comparisons: all but the last item are strict.
+    STRICT_CMPOPS = {
+        ast.Lt: operator.lt,
+        ast.LtE: operator.lt,
+        ast.Gt: operator.gt,
+        ast.GtE: operator.gt,
+        }
+    LOGICAL_OPS = {'&': ' and ', '|': ' or ', '!': ' not '}
+    UNARYOPS = {
+        ast.UAdd: operator.pos,
+        ast.USub: operator.neg,
+        ast.Invert: operator.invert,
+        }
+
+    def __init__(self, vector=False):
+        self.vector = vector
+
+    @classmethod
+    def parse(cls, s):
+        """Parse and optimize expression, return syntax tree."""
+        # Replace `&`, `|`, and `!` (but not `!=`) outside string literals
+        # with `and`, `or`, and `not`, which bind looser than comparisons.
+        s = re.sub(r'''('[^']*'|"[^"]*")|(&|\||!(?!=))''',
+                   lambda x: x.group(1) or cls.LOGICAL_OPS[x.group(2)], s)
+        tree = ast.parse(s.strip(), mode='eval')
+        return ast.fix_missing_locations(cls.optimize(tree))
+
+    @classmethod
+    def is_bool(cls, node):
+        """Is node known to evaluate to a boolean?"""
+        if isinstance(node, ast.Compare):
+            return True
+        if isinstance(node, ast.UnaryOp):
+            return isinstance(node.op, ast.Not)
+        if isinstance(node, ast.BoolOp):
+            return all(cls.is_bool(x) for x in node.values)
+        if isinstance(node, ast.Name):
+            return node.id in cls.BOOL_KEYS
+        if isinstance(node, ast.Constant):
+            return isinstance(node.value, bool)
+        return False
+
+    @classmethod
+    def cost(cls, node):
+        """Return cost of a comparison of integer keys, or None."""
+        if not (isinstance(node, ast.Compare) and len(node.ops) == 1):
+            return None
+        cost = 0
+        for x in [node.left] + node.comparators:
+            if isinstance(x, ast.Name) and x.id in cls.KEY_COSTS:
+                cost += cls.KEY_COSTS[x.id]
+            elif not (isinstance(x, ast.Constant) and
+                      isinstance(x.value, int) and
+                      not isinstance(x.value, bool)):
+                return None
+        if not isinstance(node.ops[0], ast.Eq):
+            cost += 0.5  # Equality is more selective.
+        return cost
+
+    @classmethod
+    def optimize(cls, node):
+        """Optimize syntax tree.
+
+        Conjunctions where every operand is a comparison of integer keys with
+        constants are sorted by cost: they cannot raise and give booleans, so
+        the order does not matter.
+        """
+        for name, value in ast.iter_fields(node):
+            if isinstance(value, ast.AST):
+                setattr(node, name, cls.optimize(value))
+            elif isinstance(value, list):
+                setattr(node, name, [cls.optimize(x) if isinstance(x, ast.AST)
+                                     else x for x in value])
+        if isinstance(node, ast.BoolOp):
+            # Flatten nested operations of the same kind.
+            values = []
+            for x in node.values:
+                if isinstance(x, ast.BoolOp) and type(x.op) is type(node.op):
+                    values.extend(x.values)
+                else:
+                    values.append(x)
+            node.values = values
+            costs = [cls.cost(x) for x in values]
+            if isinstance(node.op, ast.And) and None not in costs:
+                node.values = [x for _, x in sorted(zip(costs, values),
+                                                    key=lambda x: x[0])]
+        return node
+
+    def compile(self, node):
+        """Compile syntax tree node into a closure."""
+        try:
+            method = getattr(self, '_compile_' + type(node).__name__)
+        except AttributeError:
+            raise ValueError('Unsupported expression', ast.unparse(node))
+        return method(node)
+
+    def _compile_Expression(self, node):
+        return self.compile(node.body)
+
+    def _compile_Constant(self, node):
+        value = node.value
+        return lambda env: value
+
+    def _compile_Name(self, node):
+        name = node.id
+        if not self.vector:
+            getter = getattr(JWhen, '_key_' + name, None)
+            if getter is not None:
+                return getter
+        return lambda env: env[name]
+
+    def _compile_Tuple(self, node):
+        funcs = [self.compile(x) for x in node.elts]
+        return lambda env: tuple(f(env) for f in funcs)
+
+    def _compile_List(self, node):
+        funcs = [self.compile(x) for x in node.elts]
+        return lambda env: [f(env) for f in funcs]
+
+    def _compile_Set(self, node):
+        funcs = [self.compile(x) for x in node.elts]
+        return lambda env: {f(env) for f in funcs}
+
+    def _compile_Subscript(self, node):
+        value, index = self.compile(node.value), self.compile(node.slice)
+        return lambda env: value(env)[index(env)]
+
+    def _compile_Slice(self, node):
+        funcs = [None if x is None else self.compile(x)
+                 for x in (node.lower, node.upper, node.step)]
+        return lambda env: slice(*(None if f is None else f(env)
+                                   for f in funcs))
+
+    def _compile_IfExp(self, node):
+        test, body, orelse = (self.compile(x) for x in
+                              (node.test, node.body, node.orelse))
+        if self.vector and self.is_bool(node.test):
+            return lambda env: env.np.where(test(env), body(env),
+                                            orelse(env))
+        return lambda env: body(env) if test(env) else orelse(env)
+
+    def _compile_Attribute(self, node):
+        if node.attr.startswith('_'):
+            raise ValueError('Private attribute', ast.unparse(node))
+        value, attr = self.compile(node.value), node.attr
+        return lambda env: getattr(value(env), attr)
+
+    def _compile_Call(self, node):
+        if node.keywords:
+            raise ValueError('Keyword arguments', ast.unparse(node))
+        func = self.compile(node.func)
+        args = [self.compile(x) for x in node.args]
+        return lambda env: func(env)(*(f(env) for f in args))
+
+    def _compile_UnaryOp(self, node):
+        operand = self.compile(node.operand)
+        if isinstance(node.op, ast.Not):
+            if self.vector and self.is_bool(node.operand):
+                return lambda env: env.np.logical_not(operand(env))
+            return lambda env: not operand(env)
+        try:
+            op = self.UNARYOPS[type(node.op)]
+        except KeyError:
+            raise ValueError('Unsupported operator', ast.unparse(node))
+        return lambda env: op(operand(env))
+
+    def _compile_BinOp(self, node):
+        try:
+            op = self.BINOPS[type(node.op)]
+        except KeyError:
+            raise ValueError('Unsupported operator', ast.unparse(node))
+        left, right = self.compile(node.left), self.compile(node.right)
+        return lambda env: op(left(env), right(env))
+
+    def _compile_BoolOp(self, node):
+        funcs = [self.compile(x) for x in node.values]
+        if self.vector and self.is_bool(node):
+            if isinstance(node.op, ast.And):
+                op = operator.and_
+            else:
+                op = operator.or_
+            return lambda env: functools.reduce(op, (f(env) for f in funcs))
+        func = funcs[-1]
+        for f in reversed(funcs[:-1]):
+            if isinstance(node.op, ast.And):
+                func = self._and(f, func)
+            else:
+                func = self._or(f, func)
+        return func
+
+    @staticmethod
+    def _and(a, b):
+        return lambda env: a(env) and b(env)
+
+    @staticmethod
+    def _or(a, b):
+        return lambda env: a(env) or b(env)
+
+    def _compile_Compare(self, node):
+        if self.vector and self.is_tuple_compare(node):
+            return self._compile_tuple_compare(node)
+        if self.vector and len(node.ops) == 1 and isinstance(
+                node.ops[0], (ast.In, ast.NotIn)):
+            return self._compile_membership(node)
+        left = self.compile(node.left)
+        ops = [self.CMPOPS[type(x)] for x in node.ops]
+        rights = [self.compile(x) for x in node.comparators]
+        if len(ops) == 1:
+            op, right = ops[0], rights[0]
+            if isinstance(node.comparators[0], ast.Constant):
+                value = node.comparators[0].value
+                return lambda env: op(left(env), value)
+            return lambda env: op(left(env), right(env))
+        pairs = list(zip(ops, rights))
+
+        def compare(env):
+            a = left(env)
+            for op, right in pairs:
+                b = right(env)
+                if not op(a, b):
+                    return False
+                a = b
+            return True
+        return compare
+
+    def _compile_membership(self, node):
+        """Test membership of column items with `isin()`."""
+        left = self.compile(node.left)
+        right = self.compile(node.comparators[0])
+        op = self.CMPOPS[type(node.ops[0])]
+        invert = isinstance(node.ops[0], ast.NotIn)
+
+        def compare(env):
+            a, b = left(env), right(env)
+            if not isinstance(a, env.np.ndarray):
+                return op(a, b)
+            return env.np.isin(a, list(b), invert=invert)
+        return compare
+
+    @classmethod
+    def is_tuple_compare(cls, node):
+        """Is node a single comparison of tuples of the same length?"""
+        if len(node.ops) != 1:
+            return False
+        op = type(node.ops[0])
+        left, right = node.left, node.comparators[0]
+        return (isinstance(left, ast.Tuple) and isinstance(right, ast.Tuple)
+                and len(left.elts) == len(right.elts) > 0 and
+                (op in (ast.Eq, ast.NotEq) or op in cls.STRICT_CMPOPS))
+
+    def _compile_tuple_compare(self, node):
+        """Compare tuples item by item, combining the masks elementwise."""
+        lefts = [self.compile(x) for x in node.left.elts]
+        rights = [self.compile(x) for x in node.comparators[0].elts]
+        op = type(node.ops[0])
+
+        def items(env):
+            return [(f(env), g(env)) for f, g in zip(lefts, rights)]
+
+        if op in (ast.Eq, ast.NotEq):
+            def compare(env):
+                res = functools.reduce(operator.and_,
+                                       (a == b for a, b in items(env)))
+                if op is ast.NotEq:
+                    return env.np.logical_not(res)
+                return res
+            return compare
+        last, strict = self.CMPOPS[op], self.STRICT_CMPOPS[op]
+
+        def compare_order(env):
+            *init, (a, b) = items(env)
+            res = last(a, b)
+            for a, b in reversed(init):
+                res = strict(a, b) | ((a == b) & res)
+            return res
+        return compare_order
+
+
+class Expression:
+    """A compiled expression. Call with a `JWhen` to evaluate.
+
+    The vector version for `JWhenColumns` is compiled on first use. When
+    pickled, only the optimized syntax tree is stored.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.tree = ExprCompiler.parse(source)
+        self._build()
+
+    def __repr__(self):
+        return f'{self.__class__.__qualname__}({self.source!r})'
+
+    def __getstate__(self):
+        return dict(source=self.source, tree=self.tree)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build()
+
+    def _build(self):
+        self.func = ExprCompiler().compile(self.tree)
+        self.vector_func = None
+
+    def __call__(self, jwhen):
+        return self.func(jwhen)
+
+    def eval_columns(self, columns):
+        """Evaluate over `JWhenColumns`."""
+        if self.vector_func is None:
+            self.vector_func = ExprCompiler(vector=True).compile(self.tree)
+        return self.vector_func(columns)
+
+
+class Rule:
+    """A jwhen rule with its expression compiled once.
+
+    The expression kind is one of 'ymd' (plain date string), 'iso' (`=` date),
+    'md' (`*` month and day), or 'code' (`Expression`).
+    """
+    def __init__(self, exp, desc):
+        self.exp = exp
+        self.desc = desc
+        self.kind, self.value = self.compile(exp)
+
+    def __repr__(self):
+        return f'{self.__class__.__qualname__}({self.exp!r}, {self.desc!r})'
+
+    @staticmethod
+    def compile(s):
+        """Compile expression, return kind and value."""
+        try:
+            res = parse_date_string(s)
+            return 'ymd', dict(zip('year month day'.split(), res))
+        except ValueError:
+            # res = parse_date_exp(s)
+            pass
+        if s[0] == '=':
+            return 'iso', Date.fromisoformat(s[1:])
+        if s[0] == '*':
+            _, m, d = s.split()
+            return 'md', dict(month=int(m), day=int(d))
+        return 'code', Expression(s)
+
+
+class JWhenColumns(dict):
+    """Date keys as NumPy columns for a range of consecutive days.
+
+    This is the batch counterpart of `JWhen`: each supported key is an array
+    with one item per day, computed on first access by its `_col_` method.
+    Requires NumPy.
+    """
+    EPOCH = 719163  # Gregorian ordinal of 1970-01-01.
+    WEEKDAYS = 'Mon Tue Wed Thu Fri Sat Sun'.split()
+
+    def __init__(self, begin, ndays):
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+        super().__init__()
+        self.np = np
+        self.begin = begin
+        self.ndays = ndays
+
+    def __missing__(self, key):
+        if key.capitalize() in self.WEEKDAYS:
+            return key.capitalize()
+        if key in FEASTS:
+            value = self['gd'] == self._feast_ordinals(key)
+        else:
+            try:
+                value = getattr(self, '_col_' + key)()
+            except AttributeError:
+                raise KeyError(key)
+        self[key] = value
+        return value
+
+    def _feast_ordinals(self, name):
+        """Return the ordinal of the feast in each day's year."""
+        y = self['y']
+        first = int(y.min())
+        fill_feast_tables(first, int(y.max()) + 1)
+        ordinals = self.np.array([feasts(x)[name].toordinal() for x in
+                                  range(first, y.max() + 1)])
+        return ordinals[y - first]
+
+    def _col_gd(self):
+        start = self.begin.toordinal()
+        return self.np.arange(start, start + self.ndays)
+
+    def _col_dt64(self):
+        return (self['gd'] - self.EPOCH).astype('datetime64[D]')
+
+    def _col_y(self):
+        return self['dt64'].astype('datetime64[Y]').astype(int) + 1970
+
+    def _col_m(self):
+        return self['dt64'].astype('datetime64[M]').astype(int) % 12 + 1
+
+    def _col_d(self):
+        dt64 = self['dt64']
+        return (dt64 - dt64.astype('datetime64[M]')).astype(int) + 1
+
+    def _col_i(self):
+        return self.np.datetime_as_string(self['dt64'])
+
+    def _col_wd(self):
+        return (self['gd'] - 1) % 7 + 1
+
+    def _col_wa(self):
+        names = [Date.fromordinal(x).strftime('%a') for x in range(1, 8)]
+        return self.np.array(names)[self['wd'] - 1]
+
+    def _col_iso_thursday(self):
+        # The ISO week and its year are those of the week's Thursday.
+        return (self['gd'] - self['wd'] + 4 - self.EPOCH).astype(
+            'datetime64[D]')
+
+    def _col_wk(self):
+        thursday = self['iso_thursday']
+        yd = (thursday - thursday.astype('datetime64[Y]')).astype(int)
+        return yd // 7 + 1
+
+    def _col_wy(self):
+        thursday = self['iso_thursday']
+        return thursday.astype('datetime64[Y]').astype(int) + 1970
+
+    def _col_yd(self):
+        dt64 = self['dt64']
+        return (dt64 - dt64.astype('datetime64[Y]')).astype(int) + 1
+
+    def _col_a(self):
+        return (self['d'] - 1) // 7 + 1
+
+    def _col_b(self):
+        dt64 = self['dt64']
+        next_month = (dt64.astype('datetime64[M]') + 1).astype('datetime64[D]')
+        return ((next_month - dt64).astype(int) - 1) // 7 + 1
+
+    def _col_pd(self):
+        start = self.begin.toordinal()
+        fields = date_fields(start, start + self.ndays)
+        return self.np.array(fields['posixday'])
+
+    def _col_workday(self):
+        return self['wd'] < 6
+
+    def _col_until_easter(self):
+        return self._feast_ordinals('easter') - self['gd']
+
+    def eval_rule(self, rule):
+        """Evaluate rule for all days, return a boolean mask.
+
+        Return None if the rule cannot be evaluated in batch, e.g. if it uses
+        `and` or `or` on non-booleans, tuples other than in comparisons, or
+        keys that have no column.
+        """
+        np = self.np
+        if rule.kind == 'ymd':
+            v = rule.value
+            res = ((self['y'] == v['year']) & (self['m'] == v['month']) &
+                   (self['d'] == v['day']))
+        elif rule.kind == 'iso':
+            res = self['gd'] == rule.value.toordinal()
+        elif rule.kind == 'md':
+            v = rule.value
+            res = (self['m'] == v['month']) & (self['d'] == v['day'])
+        else:
+            # pylint: disable=broad-except
+            try:
+                res = rule.value.eval_columns(self)
+            except Exception:
+                return None
+        res = np.asarray(res)
+        if res.dtype.kind not in 'biu':
+            return None
+        try:
+            return np.broadcast_to(res, (self.ndays,)).astype(bool)
+        except ValueError:
+            return None
+
+
 def parse_date_string(s):
     """Attempt to parse the expression as a simple date string."""
     # https://en.wikipedia.org/wiki/ISO_8601
@@ -166,8 +690,6 @@ def parse_date_string(s):
     match = re.match(date_ymd, s)
     if match is None:
         raise ValueError('No valid date string found', s)
-    print('###', match.groups())
-    print('###', [int(x.lstrip('0')) for x in match.groups()])
     return [int(x.lstrip('0')) for x in match.groups()]
 
 
@@ -178,11 +700,8 @@ def parse_date_string(s):
 
 def filepaths(paths, glob='*.jwhen'):
     """Get file paths, explicitly given files or expanded directories."""
-    for path in paths:
-        if path.is_dir():
-            yield from sorted(x for x in path.glob(glob) if x.is_file())
-        else:
-            yield path
+    for path, _ in scan_files(paths, glob=glob):
+        yield path
 
 
 def relative_date(difference):
@@ -196,17 +715,61 @@ def parse_line(line):
     return exp, desc
 
 
-def do_file(jwhen, path):
-    """Process a jwhen file."""
+def compile_file(path):
+    """Read a jwhen file and compile its rules."""
+    rules = []
     for line in valid_lines(path):
         try:
-            exp, desc = parse_line(line)
+            rules.append(Rule(*parse_line(line)))
         except ValueError as e:
             print(e)
             print(line)
+    return rules
+
+
+def load_rules(paths, cache=None, glob='*.jwhen'):
+    """Get compiled rules from files, using an optional `FileCache`."""
+    rules = []
+    for path, stat in scan_files(paths, glob=glob):
+        if cache is None:
+            rules.extend(compile_file(path))
+        else:
+            rules.extend(cache.get(path, stat, compile_file))
+    if cache is not None:
+        cache.save()
+    return rules
+
+
+def do_file(jwhen, path):
+    """Process a jwhen file."""
+    for rule in compile_file(path):
+        res = jwhen.eval_rule(rule)
+        yield res, rule.desc, jwhen
+
+
+def eval_range(rules, begin, ndays, everything=False):
+    """Evaluate rules for a range of days, using NumPy columns where possible.
+
+    Return a list with an item per day, each a list of `(rule, res, raw)`
+    tuples, where `res` is the result and `raw` the unconverted result as in
+    `JWhen.eval_rule()`. Only matching rules are included, unless `everything`
+    is set. The masks from `JWhenColumns` only preselect the days: they are
+    evaluated one by one like before, so the results are identical.
+    """
+    columns = JWhenColumns(begin, ndays)
+    jwhen = JWhen()
+    days = [[] for _ in range(ndays)]
+    for rule in rules:
+        mask = None if everything else columns.eval_rule(rule)
+        if mask is None:
+            indices = range(ndays)
         else:
-            res = jwhen.eval(exp)
-            yield res, desc, jwhen
+            indices = columns.np.flatnonzero(mask)
+        for i in indices:
+            res = jwhen.set_today(begin.tomorrow(int(i))).eval_rule(rule)
+            if res or everything:
+                days[i].append((rule, res, jwhen.res))
+    return days
 
 
 def output(res, desc, d, formatted, relative, verbose):
@@ -229,20 +792,45 @@ def output(res, desc, d, formatted, relative, verbose):
 @click.option('-p', '--past', type=int, default=1,
               help='Number of past days to show.')
 @click.option('--fmt', default='date_week', help='Output date format.')
+@click.option('-b', '--batch', is_flag=True,
+              help='Evaluate the whole range at once (requires NumPy).')
+@click.option('--cache/--no-cache', default=True,
+              help='Use cache of compiled files.')
 @click.option('-v', '--verbose', count=True, help='Increase verbosity.')
-def cli_jwhen(paths, today, future, past, fmt, verbose):
+def cli_jwhen(paths, today, future, past, fmt, batch, cache, verbose):
     """Process a when(1)-style file."""
     if today:
         today = Date.fromisoformat(today)
+    appdir = Path(click.get_app_dir('jwhen'))
     if not paths:
-        paths = [Path(click.get_app_dir('jwhen'))]  # ~/.config/jwhen/*.jwhen
+        paths = [appdir]  # ~/.config/jwhen/*.jwhen
+    if cache:
+        cache = FileCache(appdir / CACHE_NAME, version=CACHE_VERSION)
+    else:
+        cache = None
     fmt = DEFAULT_FORMATS.get(fmt, fmt)
     jwhen = JWhen(today=today)
     begin = jwhen.today
+    rules = load_rules(paths, cache=cache)
+    if batch:
+        try:
+            days = eval_range(rules, begin.tomorrow(-past), past + future,
+                              everything=verbose > 1)
+        except ImportError as e:
+            logging.warning('Batch mode not available: %s', e)
+        else:
+            for i, hits in enumerate(days, -past):
+                jwhen.set_today(begin.tomorrow(i))
+                formatted = jwhen.today.strftime(fmt)
+                relative = relative_date(i)
+                for rule, res, raw in hits:
+                    jwhen.exp, jwhen.res = rule.exp, raw
+                    output(res, rule.desc, jwhen, formatted, relative, verbose)
+            return
     for i in range(-past, future):
         jwhen.set_today(begin.tomorrow(i))
         formatted = jwhen.today.strftime(fmt)
         relative = relative_date(i)
-        for path in filepaths(paths):
-            for res, desc, d in do_file(jwhen, path):
-                output(res, desc, d, formatted, relative, verbose)
+        for rule in rules:
+            res = jwhen.eval_rule(rule)
+            output(res, rule.desc, jwhen, formatted, relative, verbose)
@@ -11,6 +11,13 @@
 # ~/.config/stacky/stacky.cfg  # Config file, use format "--param foobar"
 # ####
 
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
 from pathlib import Path
 
 
@@ -20,8 +27,8 @@ class LineStack:
     def __init__(self, path):
         """..."""
         self.path = Path(path)
-        self.bak_path = path.with_suffix(path.suffix + '.bak')
-        self.popped_path = path.with_suffix(path.suffix + '.popped')
+        self.bak_path = self.path.with_suffix(self.path.suffix + '.bak')
+        self.popped_path = self.path.with_suffix(self.path.suffix + '.popped')
 
     def nlines(self):
         """..."""
@@ -36,3 +43,263 @@ class LineStack:
             self.popped_path.write_text(line)
             write.writelines(read)
         return line
+
+
+class JournalLineStack(LineStack):
+    """Line stack that pops by advancing a head offset, without rewriting.
+
+    Lines are popped from the beginning, and pushed to the end of the file.
+    The head offset, the file size, and the line count are kept in a sidecar
+    file with suffix `.head`. Lines appended by others are noticed by the
+    grown size, but other changes to the file break the stack, unless the
+    sidecar is removed. The popped part is dropped when it is at least
+    `compact_size` bytes and half of the file. All operations hold an
+    exclusive `flock()` on a `.lock` file.
+    """
+
+    def __init__(self, path, compact_size=2**20):
+        """..."""
+        super().__init__(path)
+        self.head_path = self.path.with_suffix(self.path.suffix + '.head')
+        self.lock_path = self.path.with_suffix(self.path.suffix + '.lock')
+        self.compact_size = compact_size
+        self.state = None
+
+    @contextmanager
+    def _locked(self):
+        """Hold lock and keep state loaded."""
+        with self.lock_path.open('a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.state = self._read_state()
+                yield self.state
+            finally:
+                self.state = None
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        """Read sidecar, and catch up with lines appended by others."""
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        try:
+            state = json.loads(self.head_path.read_text())
+        except (OSError, ValueError):
+            state = dict(offset=0, size=0, nlines=0)
+        if 0 < state['offset'] and size == state['size'] - state['offset']:
+            # Compaction was interrupted before the sidecar was written.
+            state['size'] = size
+            state['offset'] = 0
+        if size < state['size']:
+            raise ValueError('Stack file has shrunk: {}'.format(self.path))
+        if size > state['size']:
+            # Count only terminated lines, like _push() does.
+            with self.path.open('rb') as fp:
+                fp.seek(state['size'])
+                state['nlines'] += sum(x.count(b'\n') for x in
+                                       iter(lambda: fp.read(2**16), b''))
+            state['size'] = size
+        return state
+
+    def _write_state(self):
+        """Write sidecar atomically."""
+        tmp_path = self.head_path.with_suffix(self.head_path.suffix + '.tmp')
+        tmp_path.write_text(json.dumps(self.state))
+        os.replace(tmp_path, self.head_path)
+
+    def nlines(self):
+        """..."""
+        with self._locked() as state:
+            return state['nlines']
+
+    def _readlines(self, n):
+        """Read up to n lines at head offset."""
+        n = min(n, self.state['nlines'])
+        if n <= 0:
+            return []
+        with self.path.open('rb') as fp:
+            fp.seek(self.state['offset'])
+            return [x for x in (fp.readline() for _ in range(n)) if x]
+
+    def _pop(self, n):
+        """Pop up to n lines, with lock held."""
+        lines = self._readlines(n)
+        self._advance(lines)
+        return [x.decode() for x in lines]
+
+    def _advance(self, lines):
+        """Move head past lines just read, with lock held."""
+        if lines:
+            state = self.state
+            self.popped_path.write_bytes(b''.join(lines))
+            state['offset'] += sum(len(x) for x in lines)
+            state['nlines'] -= len(lines)
+            if (state['offset'] >= self.compact_size and
+                    state['offset'] * 2 >= state['size']):
+                self._compact()
+            self._write_state()
+
+    def _push(self, lines):
+        """Push lines, with lock held."""
+        data = ''.join(x if x.endswith('\n') else x + '\n' for x in lines)
+        data = data.encode()
+        with self.path.open('a+b') as fp:
+            if fp.seek(0, os.SEEK_END) != self.state['size']:
+                raise ValueError('Stack file has changed: {}'.format(
+                    self.path))
+            if self.state['size']:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1) != b'\n':
+                    # Terminate the last line instead of gluing onto it.
+                    data = b'\n' + data
+            fp.write(data)
+        self.state['nlines'] += data.count(b'\n')
+        self.state['size'] += len(data)
+        self._write_state()
+
+    def peek(self):
+        """Return top line without popping it."""
+        with self._locked():
+            return b''.join(self._readlines(1)).decode()
+
+    def pop(self):
+        """..."""
+        with self._locked():
+            return ''.join(self._pop(1))
+
+    def popn(self, n):
+        """Pop up to n lines at once. All of them are saved as popped."""
+        with self._locked():
+            return self._pop(n)
+
+    def pushn(self, lines):
+        """Push lines to the end."""
+        with self._locked():
+            self._push(lines)
+
+    def push(self, line):
+        """Push a line to the end."""
+        self.pushn([line])
+
+    def _compact(self):
+        """Drop the popped part from the file."""
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        with self.path.open('rb') as read, tmp_path.open('wb') as write:
+            read.seek(self.state['offset'])
+            shutil.copyfileobj(read, write)
+        os.replace(tmp_path, self.path)
+        self.state['size'] -= self.state['offset']
+        self.state['offset'] = 0
+
+    def compact(self):
+        """Drop the popped part from the file now."""
+        with self._locked():
+            self._compact()
+            self._write_state()
+
+
+class LeaseQueue(JournalLineStack):
+    """Work queue of lines for several consumers, with leases.
+
+    A leased batch of lines is recorded in an in-progress journal (suffix
+    `.leases`, JSON lines) with a deadline. It is done when acknowledged; if
+    the deadline passes first, its lines are pushed back to the queue on the
+    next lease.
+    """
+
+    def __init__(self, path, compact_size=2**20):
+        """..."""
+        super().__init__(path, compact_size=compact_size)
+        self.leases_path = self.path.with_suffix(self.path.suffix + '.leases')
+
+    def _read_leases(self):
+        """Read journal, return records and pending leases by id.
+
+        An unterminated or unparsable last record is what a crash while
+        appending leaves; it is ignored, and cut off the journal.
+        """
+        records = []
+        try:
+            with self.leases_path.open('r+b') as fp:
+                lines = fp.readlines()
+                for i, line in enumerate(lines):
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError('Unterminated record')
+                        records.append(json.loads(line))
+                    except ValueError:
+                        if i < len(lines) - 1:
+                            raise
+                        fp.truncate(sum(len(x) for x in lines[:i]))
+        except FileNotFoundError:
+            pass
+        pending = {}
+        for record in records:
+            if 'lines' in record:
+                pending[record['id']] = record
+            else:
+                pending.pop(record['id'], None)
+        return records, pending
+
+    def _journal(self, records, new, pending):
+        """Append new records to journal, or rewrite it if mostly done."""
+        if not pending or len(records) + len(new) > 2 * len(pending) + 100:
+            tmp_path = self.leases_path.with_suffix(
+                self.leases_path.suffix + '.tmp')
+            with tmp_path.open('w') as fp:
+                fp.writelines(json.dumps(x) + '\n' for x in pending.values())
+            os.replace(tmp_path, self.leases_path)
+        else:
+            with self.leases_path.open('a') as fp:
+                fp.writelines(json.dumps(x) + '\n' for x in new)
+
+    def _requeue(self, pending, now):
+        """Push lines of expired leases back. Return done records."""
+        expired = [x for x in pending.values() if x['deadline'] < now]
+        for lease in expired:
+            self._push(lease['lines'])
+            del pending[lease['id']]
+        return [dict(id=x['id'], requeued=True) for x in expired]
+
+    def lease(self, n=1, timeout=300):
+        """Pop up to n lines for `timeout` seconds. Return (id, lines)."""
+        with self._locked():
+            records, pending = self._read_leases()
+            new = self._requeue(pending, time.time())
+            data = self._readlines(n)
+            lines = [x.decode() for x in data]
+            lease_id = None
+            if lines:
+                lease_id = uuid.uuid4().hex
+                pending[lease_id] = dict(id=lease_id, lines=lines,
+                                         deadline=time.time() + timeout)
+                new.append(pending[lease_id])
+            if new:
+                self._journal(records, new, pending)
+            # Only now that the lease is recorded, advance the head.
+            self._advance(data)
+            return lease_id, lines
+
+    def ack(self, lease_id):
+        """Mark lease done. Return False if it was not pending anymore."""
+        with self._locked():
+            records, pending = self._read_leases()
+            if pending.pop(lease_id, None) is None:
+                return False
+            self._journal(records, [dict(id=lease_id)], pending)
+            return True
+
+    def requeue_expired(self):
+        """Push lines of expired leases back now. Return their number."""
+        with self._locked():
+            records, pending = self._read_leases()
+            new = self._requeue(pending, time.time())
+            if new:
+                self._journal(records, new, pending)
+            return len(new)
+
+    def pending(self):
+        """Return pending leases as dicts with id, lines, and deadline."""
+        with self._locked():
+            return list(self._read_leases()[1].values())
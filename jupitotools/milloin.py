@@ -6,14 +6,22 @@
 # http://newville.github.io/asteval/
 # https://en.wikipedia.org/wiki/ISO_8601
 
-from functools import lru_cache
-from pathlib import Path
+import datetime
+import json
+import logging
+import os
 import re
+import socket
+import socketserver
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
 
 import click
 
-from .files import valid_lines
-from .time import Date
+from .files import FileCache, scan_files, valid_lines
+from .time import FEASTS, Date, feasts, fill_feast_tables
 
 # From when(1) manual (http://www.lightandmatter.com/when/when.html):
 #     w - day of the week
@@ -34,14 +42,99 @@ DEFAULT_FORMATS = dict(
     date_weekname='%m-%d %V~%a',
     )
 
+GLOB = '*.milloin'
+CACHE_NAME = 'cache.pickle'
+CACHE_VERSION = 3  # Bump when the cached `Event` changes.
+
+
+class DatePattern:
+    """Compiled date expression: year, month, day, where zero is a wildcard."""
+    __slots__ = ('year', 'month', 'day')
+
+    def __init__(self, year, month, day):
+        self.year = year
+        self.month = month
+        self.day = day
+
+    def __repr__(self):
+        return (f'{self.__class__.__qualname__}({self.year}, {self.month}, '
+                f'{self.day})')
+
+    @classmethod
+    def parse(cls, s):
+        """Parse date string."""
+        return cls(*parse_date_string(s))
+
+    def resolve(self, today):
+        """Return date, wildcards filled in from today."""
+        return Date(self.year or today.year, self.month or today.month,
+                    self.day or today.day)
+
+    def match(self, date, today):
+        """Does date match? Fields are compared without creating a date."""
+        return ((self.day or today.day) == date.day and
+                (self.month or today.month) == date.month and
+                (self.year or today.year) == date.year)
+
+    def occurrences(self, today, years):
+        """Return matching dates. There is only one, relative to today."""
+        # pylint: disable=unused-argument
+        return [self.resolve(today)]
+
+
+class FeastPattern:
+    """Compiled movable feast expression: name and day offset, e.g. `easter+1`.
+
+    See `time.FEASTS` for the names. Recurs every year.
+    """
+    __slots__ = ('name', 'offset')
+    REGEX = re.compile(r'([a-z_]+)([+-]\d+)?$')
+
+    def __init__(self, name, offset=0):
+        self.name = name
+        self.offset = datetime.timedelta(days=offset)
+
+    def __repr__(self):
+        return (f'{self.__class__.__qualname__}({self.name!r}, '
+                f'{self.offset.days})')
+
+    @classmethod
+    def parse(cls, s):
+        """Parse feast expression."""
+        match = cls.REGEX.match(s)
+        if match is None or match.group(1) not in FEASTS:
+            raise ValueError('No valid feast expression found', s)
+        name, offset = match.groups()
+        return cls(name, int(offset or 0))
+
+    def match(self, date, today):
+        """Does date match?"""
+        # pylint: disable=unused-argument
+        date = date - self.offset
+        return date == feasts(date.year)[self.name]
+
+    def occurrences(self, today, years):
+        """Return matching dates within years."""
+        # pylint: disable=unused-argument
+        return [feasts(x)[self.name] + self.offset for x in years]
+
 
 class Event:
-    """Calendar event."""
+    """Calendar event.
+
+    The expression is compiled into a matcher on first use; it, `time()`, and
+    `location()` are cached in slots, so nothing outlives the event. If the
+    expression is invalid, the matcher is None, and the error is kept in
+    `error`, so that it can be reported also for cached events.
+    """
     SEP = ';'
+    __slots__ = ('line', 'path', 'expr', 'descs', 'desc', 'error', '_matcher',
+                 '_time', '_location')
 
     def __init__(self, line, path):
         self.line = line
         self.path = path
+        self.error = None
         self.expr, *self.descs = [x.strip() for x in line.split(self.SEP)]
         self.desc = self.descs[0]
 
@@ -51,36 +144,86 @@ class Event:
     def __str__(self):
         return f'{self.path}: {self.expr}; {self.desc}'
 
-    @lru_cache()
+    @property
+    def matcher(self):
+        """Compiled expression, or None if it is not valid."""
+        try:
+            return self._matcher
+        except AttributeError:
+            pass
+        try:
+            self._matcher = DatePattern.parse(self.expr)
+        except ValueError as e:
+            try:
+                self._matcher = FeastPattern.parse(self.expr)
+            except ValueError:
+                self.error = e
+                self._matcher = None
+        return self._matcher
+
     def time(self):
         """Return event time, or None."""
+        try:
+            return self._time
+        except AttributeError:
+            pass
         tokens = self.desc.split(maxsplit=1)
-        if tokens and '/' in tokens[0]:
-            return tokens[0]
-        return None
+        self._time = tokens[0] if tokens and '/' in tokens[0] else None
+        return self._time
 
-    @lru_cache()
     def location(self):
         """Return event location, or None."""
+        try:
+            return self._location
+        except AttributeError:
+            pass
         tokens = self.desc.split('@', 1)
-        if len(tokens) > 1:
-            return tokens[1]
-        return None
+        self._location = tokens[1] if len(tokens) > 1 else None
+        return self._location
 
-    @lru_cache()
-    def match(self, date, today):
-        """Does date match with event?"""
-        # TODO
+    def occurrences(self, today, years):
+        """Return event dates within years, wildcards filled in from today."""
+        if self.matcher is None:
+            return []
         try:
-            y, m, d = parse_date_string(self.expr)
-            parsed = Date(y or today.year, m or today.month, d or today.day)
-            return date == parsed
+            return self.matcher.occurrences(today, years)
         except ValueError as e:
             print(e)
+        return []
+
+    def match(self, date, today):
+        """Does date match with event?"""
+        if self.matcher is None:
+            return None
+        return self.matcher.match(date, today)
         # # TODO: For testing.
         # return abs(date.toordinal() - today.toordinal()) < 2
 
 
+class EventIndex:
+    """Events indexed by date, for looking up matches without a full scan.
+
+    The occurrences of every event within `years` (default: today's year) are
+    computed once, so a lookup is a single dict access and costs only the
+    number of matches.
+    """
+
+    def __init__(self, events, today, years=None):
+        if years is None:
+            years = [today.year]
+        if years:
+            fill_feast_tables(min(years), max(years) + 1)
+        self.today = today
+        self.dates = defaultdict(list)
+        for event in events:
+            for date in event.occurrences(today, years):
+                self.dates[date].append(event)
+
+    def __getitem__(self, date):
+        """Return matching events for date, in original order."""
+        return list(self.dates.get(date, ()))
+
+
 def parse_date_string(s):
     """Attempt to parse the expression as a simple date string."""
     # Empty or zero is a wildcard.
@@ -103,23 +246,51 @@ def parse_date_string(s):
     return [int(x) for x in match.groups()]
 
 
-def yield_filepaths(paths, glob='*.milloin'):
+def yield_filepaths(paths, glob=GLOB):
     """Get file paths, explicitly given files or expanded directories."""
-    for path in paths:
-        if path.is_dir():
-            yield from sorted(x for x in path.glob(glob) if x.is_file() and
-                              x.suffix != '.disable')
-        else:
+    for path, _ in scan_files(paths, glob=glob):
+        if path.suffix != '.disable':
             yield path
 
 
+def read_events(path):
+    """Read events from a file, with their expressions compiled.
+
+    Compiling here means that cached events need no parsing when loaded.
+    Errors are not reported here, but by `load_events()`, cached or not.
+    """
+    events = [Event(x, path) for x in valid_lines(path)]
+    for event in events:
+        event.matcher  # pylint: disable=pointless-statement
+    return events
+
+
+def load_events(paths, cache=None, glob=GLOB):
+    """Get file paths and their events, using an optional `FileCache`."""
+    filepaths, events = [], []
+    for path, stat in scan_files(paths, glob=glob):
+        if path.suffix == '.disable':
+            continue
+        filepaths.append(path)
+        if cache is None:
+            file_events = read_events(path)
+        else:
+            file_events = cache.get(path, stat, read_events)
+        for event in file_events:
+            if event.error is not None:
+                print(event.error)
+        events.extend(file_events)
+    if cache is not None:
+        cache.save()
+    return filepaths, events
+
+
 def get_matches(dates, events, today):
     """Get matches."""
-    def collect_matches(date):
-        def is_match(event):
-            return event.match(date, today)
-        return filter(is_match, events)
-    return {x: list(collect_matches(x)) for x in dates}
+    # Spare years around the range, for feasts with large offsets.
+    years = range(min(dates).year - 1, max(dates).year + 2) if dates else []
+    index = EventIndex(events, today, years=years)
+    return {x: index[x] for x in dates}
 
 
 def date_marker(date, today):
@@ -133,6 +304,169 @@ def date_marker(date, today):
     return ' '
 
 
+def agenda_lines(dates, events, today):
+    """Generate agenda lines."""
+    matches = get_matches(dates, events, today)
+    for date, date_events in matches.items():
+        marker = date_marker(date, today)
+        datestr_normal = str(date)
+        datestr_repeating = ' ' * len(datestr_normal)
+        if not date_events:
+            yield f'{marker} {datestr_normal} (no events)'
+        for i, event in enumerate(date_events):
+            datestr = datestr_normal if i == 0 else datestr_repeating
+            eventstr = str(event)[:70]
+            yield f'{marker} {datestr} {eventstr}'
+
+
+def dates_lines(dates, events, today):
+    """Generate date list lines."""
+    # pylint: disable=unused-argument
+    for date in dates:
+        marker = date_marker(date, today)
+        yield f'{marker} {date}'
+
+
+def all_lines(dates, events, today):
+    """Generate event list lines."""
+    # pylint: disable=unused-argument
+    for event in events:
+        yield str(event)
+        if any([event.time(), event.location()]):
+            yield ' '.join(str(x) for x in ['-', event.time(),
+                                            event.location()])
+
+
+COMMANDS = dict(agenda=agenda_lines, dates=dates_lines, all=all_lines)
+
+
+def get_dates(today, past, future):
+    """Get date range."""
+    return [today.tomorrow(x) for x in range(-past, future + 1)]
+
+
+class Calendar:
+    """Events from calendar files, reloaded when the files change."""
+
+    def __init__(self, paths, cache=None):
+        self.paths = paths
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.signature = None
+        self.filepaths = []
+        self.events = []
+        self.reload()
+
+    def scan(self):
+        """Return a signature of the calendar files."""
+        return tuple((os.fspath(x), y.st_mtime_ns, y.st_size) for x, y in
+                     scan_files(self.paths, glob=GLOB))
+
+    def reload(self):
+        """Reload events if files have changed. Return True if reloaded."""
+        try:
+            signature = self.scan()
+            if signature == self.signature:
+                return False
+            filepaths, events = load_events(self.paths, cache=self.cache)
+        except OSError as e:
+            logging.error('Cannot reload: %s', e)
+            return False
+        with self.lock:
+            self.signature = signature
+            self.filepaths = filepaths
+            self.events = events
+        logging.info('Loaded %d events from %d files', len(events),
+                     len(filepaths))
+        return True
+
+    def watch(self, interval=2):
+        """Reload on changes, forever.
+
+        Use inotify if the `inotify_simple` package is available, otherwise
+        poll every `interval` seconds. Paths that cannot be watched are
+        skipped; if none can, poll.
+        """
+        # pylint: disable=import-outside-toplevel
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            self.poll(interval)
+        inotify = INotify()
+        mask = (flags.CLOSE_WRITE | flags.CREATE | flags.DELETE |
+                flags.MOVED_FROM | flags.MOVED_TO)
+        nwatches = 0
+        for path in self.paths:
+            try:
+                inotify.add_watch(path if path.is_dir() else path.parent,
+                                  mask)
+                nwatches += 1
+            except OSError as e:
+                logging.warning('Cannot watch: %s: %s', path, e)
+        if not nwatches:
+            inotify.close()
+            self.poll(interval)
+        while True:
+            if inotify.read(timeout=interval * 1000, read_delay=100):
+                self.reload()
+
+    def poll(self, interval):
+        """Reload on changes, checking every `interval` seconds, forever."""
+        while True:
+            time.sleep(interval)
+            self.reload()
+
+    def query(self, command, today, past, future):
+        """Return output lines of command."""
+        today = Date.fromisoformat(today)
+        with self.lock:
+            events = self.events
+        return list(COMMANDS[command](get_dates(today, past, future), events,
+                                      today))
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """Handle a query: a JSON line of `Calendar.query()` arguments."""
+
+    def handle(self):
+        try:
+            lines = self.server.calendar.query(**json.loads(
+                self.rfile.readline()))
+        except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+            lines = [f'Invalid query: {e}']
+        except Exception as e:  # pylint: disable=broad-except
+            logging.exception('Query failed: %s', e)
+            lines = [f'Query failed: {e}']
+        self.wfile.write(''.join(f'{x}\n' for x in lines).encode())
+
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Calendar query server."""
+    daemon_threads = True
+
+    def __init__(self, path, calendar):
+        self.calendar = calendar
+        super().__init__(os.fspath(path), QueryHandler)
+
+
+def query(path, **kwargs):
+    """Query a server, return output lines."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(os.fspath(path))
+        sock.sendall(json.dumps(kwargs).encode() + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile(encoding='utf-8') as fp:
+            return [x.rstrip('\n') for x in fp]
+
+
+def default_socket_path():
+    """Return default server socket path."""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return Path(runtime_dir) / 'milloin.sock'
+    return Path(click.get_app_dir('milloin')) / 'milloin.sock'
+
+
 @click.group()
 @click.option('-P', '--path', type=Path, help='Input path')
 @click.option('-t', '--today', help='Date today.')
@@ -141,62 +475,106 @@ def date_marker(date, today):
 @click.option('-p', '--past', type=int, default=1,
               help='Number of past days to show.')
 @click.option('--fmt', default='date_week', help='Output date format.')
+@click.option('--cache/--no-cache', default=True,
+              help='Use cache of parsed files.')
+@click.option('-r', '--remote', is_flag=True,
+              help='Query a running server instead of reading files.')
+@click.option('-S', '--socket', 'socket_path', type=Path,
+              help='Server socket path.')
 @click.option('-v', '--verbose', count=True, help='Increase verbosity.')
 @click.pass_context
-def cli(ctx, path, today, future, past, fmt, verbose):
+def cli(ctx, path, today, future, past, fmt, cache, remote, socket_path,
+        verbose):
     """A when(1)-style calendar application."""
     ctx.ensure_object(dict)
-    paths = [path]
-    if not paths:
-        # ~/.config/milloin/*.milloin
-        paths = [Path(click.get_app_dir('milloin'))]
-    paths = list(yield_filepaths(paths))
+    if remote and path is not None:
+        raise click.UsageError('Cannot use --path with --remote: the server '
+                               'reads the paths it was started with.')
+    appdir = Path(click.get_app_dir('milloin'))
+    paths = [path or appdir]  # ~/.config/milloin/*.milloin
     today = Date.fromisoformat(today) if today else Date.today()
-    dates = [today.tomorrow(x) for x in range(-past, future + 1)]
-    events = [Event(y, x) for x in paths for y in valid_lines(x)]
-    ctx.obj['paths'] = paths
+    ctx.obj['inputs'] = paths
+    ctx.obj['cache'] = None
     ctx.obj['today'] = today
-    ctx.obj['dates'] = dates
-    ctx.obj['events'] = events
+    ctx.obj['past'] = past
+    ctx.obj['future'] = future
     ctx.obj['fmt'] = DEFAULT_FORMATS.get(fmt, fmt)
+    ctx.obj['remote'] = remote
+    ctx.obj['socket'] = socket_path or default_socket_path()
     if verbose > 0:
         print(f'Today is {today}.')
+    if remote:
+        return  # Thin client: don't even load the cache.
+    if cache:
+        cache = FileCache(appdir / CACHE_NAME, version=CACHE_VERSION)
+    else:
+        cache = None
+    ctx.obj['cache'] = cache
+    if ctx.invoked_subcommand == 'serve':
+        return
+    ctx.obj['dates'] = get_dates(today, past, future)
+    paths, events = load_events(paths, cache=cache)
+    ctx.obj['paths'] = paths
+    ctx.obj['events'] = events
+    if verbose > 0:
         print(f'Filepaths: {", ".join(str(x) for x in paths)}.')
 
 
+def run_command(ctx, command):
+    """Print command output, locally or from server."""
+    obj = ctx.obj
+    if obj['remote']:
+        try:
+            lines = query(obj['socket'], command=command,
+                          today=obj['today'].isoformat(), past=obj['past'],
+                          future=obj['future'])
+        except OSError as e:
+            raise click.ClickException(f'Cannot query server: {e}')
+    else:
+        lines = COMMANDS[command](obj['dates'], obj['events'], obj['today'])
+    for line in lines:
+        print(line)
+
+
 @cli.command('agenda')
 @click.pass_context
 def cli_agenda(ctx):
     """Print agenda."""
-    today = ctx.obj['today']
-
-    matches = get_matches(ctx.obj['dates'], ctx.obj['events'], today)
-    for date, events in matches.items():
-        marker = date_marker(date, today)
-        datestr_normal = str(date)
-        datestr_repeating = ' ' * len(datestr_normal)
-        if not events:
-            print(f'{marker} {datestr_normal} (no events)')
-        for i, event in enumerate(events):
-            datestr = datestr_normal if i == 0 else datestr_repeating
-            eventstr = str(event)[:70]
-            print(f'{marker} {datestr} {eventstr}')
+    run_command(ctx, 'agenda')
 
 
 @cli.command('dates')
 @click.pass_context
 def cli_list_dates(ctx):
     """List dates."""
-    for date in ctx.obj['dates']:
-        marker = date_marker(date, ctx.obj['today'])
-        print(f'{marker} {date}')
+    run_command(ctx, 'dates')
 
 
 @cli.command('all')
 @click.pass_context
 def cli_list_all_events(ctx):
     """List all events."""
-    for event in ctx.obj['events']:
-        print(event)
-        if any([event.time(), event.location()]):
-            print('-', event.time(), event.location())
+    run_command(ctx, 'all')
+
+
+@cli.command('serve')
+@click.pass_context
+def cli_serve(ctx):
+    """Serve queries over a Unix domain socket, reloading on changes."""
+    path = ctx.obj['socket']
+    try:
+        query(path, command='dates', today=ctx.obj['today'].isoformat(),
+              past=0, future=0)
+    except OSError:
+        pass
+    else:
+        raise click.ClickException(f'Server already running: {path}')
+    if path.is_socket():
+        path.unlink()  # Stale socket from a previous run.
+    calendar = Calendar(ctx.obj['inputs'], cache=ctx.obj['cache'])
+    with QueryServer(path, calendar) as server:
+        threading.Thread(target=calendar.watch, daemon=True).start()
+        try:
+            server.serve_forever()
+        finally:
+            path.unlink()
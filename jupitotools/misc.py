@@ -1,6 +1,7 @@
 """Miscellaneous utility funcionality."""
 
 import logging
+import math
 import os
 import platform
 import shlex
@@ -20,13 +21,48 @@ class TagDict(dict):
     @classmethod
     def fromstr(cls, s, default_value=None):
         """Parse tag string."""
-        def get_key_value(tag):
-            if cls.key_sep in tag:
-                k, v = tag.split(cls.key_sep, 1)
-            else:
-                k, v = tag, default_value
-            return cls.normalize_key(k), v
-        return cls(get_key_value(x) for x in s.split(cls.tag_sep))
+        return cls(cls.parse(s, default_value=default_value))
+
+    @classmethod
+    def parse(cls, s, default_value=None):
+        """Parse tag string into a compact record: tuple of (key, value).
+
+        Keys are normalized and interned through a bounded cache, so parsing
+        lots of strings with the same keys is cheap, and the keys are shared.
+        """
+        return next(cls.parse_many([s], default_value=default_value))
+
+    @classmethod
+    def parse_many(cls, strings, default_value=None):
+        """Parse tag strings, yield records as in `parse()`."""
+        tag_sep, key_sep = cls.tag_sep, cls.key_sep
+        normalize = cls.normalize_key
+        for s in strings:
+            record = []
+            for tag in s.split(tag_sep):
+                k, sep, v = tag.partition(key_sep)
+                record.append((_interned_key(normalize, k),
+                               v if sep else default_value))
+            yield tuple(record)
+
+    @classmethod
+    def columns(cls, strings, default_value=None, missing=False):
+        """Parse tag strings into columns.
+
+        Return a dict of keys to lists of values, one for each string, with
+        `missing` where the string does not have the key.
+        """
+        records = list(cls.parse_many(strings, default_value=default_value))
+        n = len(records)
+        columns = {}
+        for i, record in enumerate(records):
+            for k, v in record:
+                try:
+                    columns[k][i] = v
+                except KeyError:
+                    columns[k] = [missing] * n
+                    columns[k][i] = v
+        return columns
 
     def __str__(self):
         """Generate tag string."""
@@ -47,6 +83,12 @@ class TagDict(dict):
     #     return len(key) and all(x.isalnum() or x in '_&/-:' for x in key)
 
 
+@lru_cache(maxsize=2**16)
+def _interned_key(normalize, key):
+    """Normalize and intern tag key."""
+    return sys.intern(normalize(key))
+
+
 def one(iterable, too_short=None, too_long=None):
     """Return the only item from iterable.
 
@@ -92,14 +134,43 @@ def numbered_lines(iterable):
     return (f'{i}: {x}' for i, x in enumerate(iterable, start=1))
 
 
-@lru_cache(maxsize=32)
+PREFIXES = ('',) + tuple('kMGTPEZY')
+
+
+def _prefix_index(n, factor, last):
+    """Return index of magnitude prefix for number, at most `last`."""
+    if factor == 1024:
+        # Exact: compare binary exponent to multiples of 10.
+        if isinstance(n, int):
+            return min((abs(n).bit_length() - 1) // 10, last) if n else 0
+        if not math.isfinite(n):
+            return last
+        return min(max(math.frexp(n)[1] - 1, 0) // 10, last)
+    i = 0
+    n = abs(n)
+    while i < last and not n < factor:
+        n /= factor
+        i += 1
+    return i
+
+
 def get_prefix(n, factor=1024, prefixes=None):
     """Get magnitude prefix for number."""
     if prefixes is None:
-        prefixes = ('',) + tuple('kMGTPEZY')
-    if abs(n) < factor or len(prefixes) == 1:
-        return n, prefixes[0]
-    return get_prefix(n / factor, factor=factor, prefixes=prefixes[1:])
+        prefixes = PREFIXES
+    last = len(prefixes) - 1
+    i = _prefix_index(n, factor, last)
+    if i:
+        if factor == 1024:
+            n /= factor ** i  # Exact, being a power of two.
+            if i < last and not abs(n) < factor:
+                # Only a large int can get rounded up to the next prefix.
+                n /= factor
+                i += 1
+        else:
+            for _ in range(i):
+                n /= factor
+    return n, prefixes[i]
 
 
 def fmt_size(n, unit='B'):
@@ -110,6 +181,25 @@ def fmt_size(n, unit='B'):
     return f'{n:.0f}{prefix}{unit}'
 
 
+def fmt_sizes(sizes, unit='B'):
+    """Format a NumPy array of sizes like `fmt_size()`, at once.
+
+    Return an array of strings. Unlike in `fmt_size()`, integers beyond 2**53
+    may be rounded.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    sizes = np.asarray(sizes, dtype=float)
+    last = len(PREFIXES) - 1
+    exponents = np.frexp(sizes)[1]
+    indices = np.clip((exponents - 1) // 10, 0, last)
+    indices[~np.isfinite(sizes)] = last
+    values = sizes / np.float_power(1024, indices)
+    prefixes = np.array(PREFIXES)[indices]
+    return np.char.add(np.char.add(np.char.mod('%.0f', values), prefixes),
+                       unit)
+
+
 def fmt_bitrate(bitrate):
     """Format human-readable bitrate, given as kb/s."""
     # return f'{bitrate}kb/s'
@@ -156,10 +246,11 @@ def ring_bell():
 # pylint: disable=too-many-arguments
 def notify_send(summary, body=None, urgency=None, expire_time=None,
                 app_name=None, icons=None, categories=None, hints=None,
-                fgcolor=None, bgcolor=None, progress=None):
+                fgcolor=None, bgcolor=None, progress=None, wait=True):
     """Send notification.
 
-    At least dunst supports fgcolor, bgcolor, progress.
+    At least dunst supports fgcolor, bgcolor, progress. Without `wait`, return
+    the started `subprocess.Popen` at once.
     """
     def _hint(typ, name, value):
         assert typ in ['int', 'double', 'string', 'byte'], typ
@@ -189,7 +280,8 @@ def notify_send(summary, body=None, urgency=None, expire_time=None,
         assert 0 <= progress <= 100, progress
         args.extend(_hint('int', 'value', progress))
     logging.debug('Running: %s', args)
-    subprocess.check_call(args)
+    run = subprocess.check_call if wait else subprocess.Popen
+    return run(args)
 
 
 def truncate(s, reserved=0, columns=None, ellipsis='…', minimum_length=2):
@@ -0,0 +1,191 @@
+"""Concurrent downloading of many files with asyncio.
+
+Each job is a `(url, dst_path)` pair, fetched by `fetch.fetch()` in a worker
+thread, sharing one keep-alive connection pool. The number of simultaneous
+downloads is limited both in total and per host. Failed downloads are
+retried with exponential backoff; thanks to the resume journal, a retry
+continues where the previous attempt stopped. If the batch is interrupted,
+the running downloads are stopped after their current chunk.
+"""
+
+import asyncio
+import http.client
+import logging
+import os
+import random
+import sys
+import threading
+import urllib.error
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import click
+
+from ..progress import Progress
+from .fetch import ConnectionPool, DownloadStopped, fetch
+
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+def _retryable(e):
+    """Is the error worth retrying?"""
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code in RETRY_STATUSES
+    return not isinstance(e, (DownloadStopped, ValueError))
+
+
+class BatchDownloader:
+    """Download many files concurrently.
+
+    At most `limit` downloads run at once, and at most `per_host` to the same
+    host. Each download uses up to `segments` connections. Failed downloads
+    are tried `retries` more times, waiting `backoff` seconds, doubled each
+    time, with some jitter. Progress can be shown also in terminal `title`
+    and as desktop notifications (`notify`).
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, limit=16, per_host=4, segments=1, retries=3,
+                 backoff=1.0, progress=True, title=False, notify=False):
+        """Init."""
+        self.limit = limit
+        self.per_host = per_host
+        self.segments = segments
+        self.retries = retries
+        self.backoff = backoff
+        self.progress = progress
+        self.title = title
+        self.notify = notify
+        self.pool = ConnectionPool(maxsize=per_host * segments)
+        self.meter = None
+        self.stop = threading.Event()
+
+    def _fetch(self, url, dst_path, state):
+        """Fetch one file, in a worker thread.
+
+        The state dict keeps the job's reported progress over retries.
+        """
+        meter = self.meter
+
+        def callback(done, total):
+            if state['total'] is None and total >= 0:
+                state['total'] = total
+                meter.add_total(total)
+            meter.add(done - state['done'])
+            state['done'] = done
+
+        return fetch(url, dst_path, segments=self.segments, pool=self.pool,
+                     callback=None if meter is None else callback,
+                     stop=self.stop)
+
+    def _failed(self, url, e):
+        """Report a failed job, return the exception as its result."""
+        logging.error('%s: %s', e, url)
+        if self.meter is not None:
+            self.meter.item_done(failed=True)
+        return e
+
+    async def _job(self, url, dst_path, executor, limit, hosts):
+        """Download with limits and retries. Return headers or exception."""
+        loop = asyncio.get_running_loop()
+        try:
+            host = urllib.parse.urlsplit(url).netloc
+        except ValueError as e:
+            return self._failed(url, e)
+        host_limit = hosts.setdefault(host, asyncio.Semaphore(self.per_host))
+        state = dict(done=0, total=None)
+        for attempt in range(self.retries + 1):
+            try:
+                async with host_limit, limit:
+                    result = await loop.run_in_executor(
+                        executor, self._fetch, url, dst_path, state)
+                if self.meter is not None:
+                    self.meter.item_done()
+                return result
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                if attempt == self.retries or not _retryable(e):
+                    return self._failed(url, e)
+                delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+                logging.debug('Retrying in %.1fs: %s: %s', delay, url, e)
+                await asyncio.sleep(delay)
+
+    async def run(self, jobs):
+        """Download `(url, dst_path)` jobs. Return list of results.
+
+        A result is the response headers, or the exception that failed it.
+        """
+        jobs = list(jobs)
+        limit = asyncio.Semaphore(self.limit)
+        hosts = {}
+        if self.progress:
+            self.meter = Progress('fetch-many', items=len(jobs), total=0,
+                                  title=self.title, notify=self.notify)
+        self.stop.clear()
+        with ThreadPoolExecutor(max_workers=self.limit) as executor:
+            try:
+                return await asyncio.gather(*(
+                    self._job(url, os.fspath(dst), executor, limit, hosts)
+                    for url, dst in jobs))
+            except BaseException:
+                # Also on cancellation by KeyboardInterrupt: don't wait for
+                # the running downloads to finish.
+                self.stop.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            finally:
+                if self.meter is not None:
+                    self.meter.close()
+                    self.meter = None
+                self.pool.close()
+
+    def download(self, jobs):
+        """Download `(url, dst_path)` jobs, blocking. See `run()`."""
+        return asyncio.run(self.run(jobs))
+
+
+def read_jobs(lines, directory):
+    """Read jobs: URL per line, optionally followed by tab and destination.
+
+    The default destination is the URL's filename in directory.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        url, _, dst = line.partition('\t')
+        if not dst:
+            name = Path(urllib.parse.unquote(urllib.parse.urlsplit(
+                url).path)).name or 'index.html'
+            dst = Path(directory) / name
+        yield url, dst
+
+
+@click.command()
+@click.argument('listfile', type=click.File(), default='-')
+@click.option('-d', '--directory', type=click.Path(file_okay=False),
+              default='.', show_default=True,
+              help='Directory for jobs without destination')
+@click.option('-j', '--jobs', type=int, default=16, show_default=True,
+              help='Maximum simultaneous downloads')
+@click.option('-p', '--per-host', type=int, default=4, show_default=True,
+              help='Maximum simultaneous downloads per host')
+@click.option('-s', '--segments', type=int, default=1, show_default=True,
+              help='Connections per download')
+@click.option('-r', '--retries', type=int, default=3, show_default=True,
+              help='Retries per download')
+@click.option('--title', is_flag=True, help='Show progress in terminal title')
+@click.option('--notify', is_flag=True,
+              help='Show progress as desktop notifications')
+def cli_fetch_many(listfile, directory, jobs, per_host, segments, retries,
+                   title, notify):
+    """Download URLs listed in LISTFILE, one per line (URL[TAB]DST)."""
+    jobs_ = list(read_jobs(listfile, directory))
+    for _, dst in jobs_:
+        Path(dst).parent.mkdir(parents=True, exist_ok=True)
+    downloader = BatchDownloader(limit=jobs, per_host=per_host,
+                                 segments=segments, retries=retries,
+                                 title=title, notify=notify)
+    results = downloader.download(jobs_)
+    if any(isinstance(x, Exception) for x in results):
+        sys.exit(1)
@@ -0,0 +1,404 @@
+"""Resumable HTTP downloads with concurrent range requests.
+
+A download is written into a `.part` file, preallocated to its full size.
+If the server supports byte ranges, the file is split into segments fetched
+concurrently over pooled keep-alive connections, each written in place with
+`os.pwrite()`. Segment progress is kept in a journal next to the part file
+(suffix `.json`), so an interrupted download continues where it left off, as
+long as the remote file has not changed. Without range support, the file is
+fetched in a single stream. Other schemes than HTTP(S), and all URLs when
+proxies are configured in the environment, are fetched in a single stream
+with `urllib.request`.
+
+A download can be stopped from another thread by setting its stop event;
+segments then give up after their current chunk, and the journal is saved.
+
+Errors are raised as `urllib.error` exceptions, like `urlretrieve()` does.
+"""
+
+import http.client
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+CHUNK_SIZE = 2**18
+MIN_SEGMENT_SIZE = 2**22
+SEGMENTS = 4
+RETRIES = 3
+TIMEOUT = 30
+MAX_REDIRECTS = 5
+JOURNAL_INTERVAL = 1.0  # Seconds between journal writes.
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) jupitotools'
+
+
+class RemoteFileChanged(urllib.error.ContentTooShortError):
+    """The remote file changed during download."""
+
+
+class DownloadStopped(urllib.error.URLError):
+    """The download was stopped by request."""
+
+
+def _use_urllib(url):
+    """Should url be fetched with `urllib.request`, for scheme or proxies?"""
+    if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+        return True
+    return any(x != 'no' for x in urllib.request.getproxies())
+
+
+class ConnectionPool:
+    """Thread-safe pool of keep-alive HTTP(S) connections, per host."""
+
+    def __init__(self, maxsize=8, timeout=TIMEOUT):
+        """Init."""
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def get(self, scheme, netloc):
+        """Return an idle connection to host, or a new one."""
+        key = scheme, netloc
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop()
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        if scheme == 'http':
+            return http.client.HTTPConnection(netloc, timeout=self.timeout)
+        raise urllib.error.URLError(f'Unsupported scheme: {scheme}')
+
+    def put(self, scheme, netloc, conn):
+        """Return a connection whose response has been fully read."""
+        with self.lock:
+            conns = self.idle.setdefault((scheme, netloc), [])
+            if len(conns) < self.maxsize:
+                conns.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def request(self, url, headers=None, method='GET'):
+        """Make a request, following redirects. Yield the response.
+
+        The final URL is available as `response.url`. The connection goes
+        back to the pool if the response was read to the end.
+        """
+        headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'identity',
+                   **(headers or {})}
+        for _ in range(MAX_REDIRECTS + 1):
+            parsed = urllib.parse.urlsplit(url)
+            path = urllib.parse.urlunsplit(('', '', parsed.path or '/',
+                                            parsed.query, ''))
+            conn = self.get(parsed.scheme, parsed.netloc)
+            reused = conn.sock is not None
+            try:
+                try:
+                    conn.request(method, path, headers=headers)
+                    response = conn.getresponse()
+                except (ConnectionError, http.client.HTTPException):
+                    # A pooled connection may have been closed by the server.
+                    if not reused:
+                        raise
+                    conn.close()
+                    conn.request(method, path, headers=headers)
+                    response = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise urllib.error.URLError(e) from e
+            response.url = url
+            location = response.getheader('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                self.put(parsed.scheme, parsed.netloc, conn)
+                url = urllib.parse.urljoin(url, location)
+                continue
+            try:
+                yield response
+            finally:
+                if response.isclosed() and not response.will_close:
+                    self.put(parsed.scheme, parsed.netloc, conn)
+                else:
+                    conn.close()
+            return
+        raise urllib.error.URLError(f'Too many redirects: {url}')
+
+    def close(self):
+        """Close idle connections."""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+def _check_status(response, expected):
+    """Raise HTTPError if response status is not expected."""
+    if response.status not in expected:
+        raise urllib.error.HTTPError(response.url, response.status,
+                                     response.reason, response.headers, None)
+
+
+def _content_range_size(response):
+    """Return total size from a Content-Range header, or None."""
+    value = response.getheader('Content-Range', '')
+    try:
+        return int(value.rsplit('/', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _validator(response):
+    """Return ETag or Last-Modified header for checking the file is same."""
+    etag = response.getheader('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.getheader('Last-Modified')
+
+
+def preallocate(fd, size):
+    """Allocate file space, or at least set the size."""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+class Journal:
+    """Resume journal: URL, size, validator, and segment positions.
+
+    Each segment is a list of `[start, position, end]`, end exclusive.
+    """
+
+    def __init__(self, path, url, size, validator, segments):
+        """Init."""
+        self.path = path
+        self.url = url
+        self.size = size
+        self.validator = validator
+        self.segments = segments
+        self.lock = threading.Lock()
+        self.saved = 0
+
+    @classmethod
+    def new(cls, path, url, size, validator, nsegments):
+        """Make journal with size split in segments."""
+        bounds = [size * i // nsegments for i in range(nsegments + 1)]
+        segments = [[a, a, b] for a, b in zip(bounds, bounds[1:]) if a < b]
+        return cls(path, url, size, validator, segments)
+
+    @classmethod
+    def load(cls, path, url, size, validator):
+        """Load journal, or return None if missing or not for this file."""
+        # pylint: disable=broad-except
+        try:
+            with open(path) as fp:
+                d = json.load(fp)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.debug('Ignoring journal %s: %s', path, e)
+            return None
+        if (d['size'], d['validator']) != (size, validator) or not validator:
+            return None
+        return cls(path, url, size, validator, d['segments'])
+
+    def done(self):
+        """Return number of bytes done."""
+        return sum(pos - start for start, pos, _ in self.segments)
+
+    def advance(self, segment, n):
+        """Advance segment position by n bytes, and save now and then."""
+        with self.lock:
+            segment[1] += n
+            if time.monotonic() - self.saved > JOURNAL_INTERVAL:
+                self.save()
+
+    def save(self):
+        """Write journal atomically."""
+        d = dict(url=self.url, size=self.size, validator=self.validator,
+                 segments=self.segments)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(d, fp)
+        os.replace(tmp_path, self.path)
+        self.saved = time.monotonic()
+
+
+class Fetch:
+    """A single download; see module docstring."""
+
+    def __init__(self, url, dst_path, part_path=None, segments=SEGMENTS,
+                 pool=None, callback=None, stop=None):
+        """Init. Call `callback(done, total)` on progress (total may be -1).
+
+        Setting the `stop` event stops the download with `DownloadStopped`.
+        """
+        self.url = url
+        self.dst_path = os.fspath(dst_path)
+        self.part_path = os.fspath(part_path or self.dst_path + '.part')
+        self.journal_path = self.part_path + '.json'
+        self.segments = segments
+        self.pool = pool or ConnectionPool(maxsize=segments)
+        self.callback = callback
+        self.done = 0
+        self.total = -1
+        self.lock = threading.Lock()
+        self.stop = threading.Event() if stop is None else stop
+
+    def _check_stop(self):
+        """Raise DownloadStopped if stop has been requested."""
+        if self.stop.is_set():
+            raise DownloadStopped(f'Download stopped: {self.url}')
+
+    def _progress(self, n):
+        with self.lock:
+            self.done += n
+            if self.callback is not None:
+                self.callback(self.done, self.total)
+
+    def run(self):
+        """Download. Return headers of the first response."""
+        if _use_urllib(self.url):
+            return self._retrieve()
+        with self.pool.request(self.url, {'Range': 'bytes=0-0'}) as response:
+            self.url = response.url
+            headers = response.headers
+            size = _content_range_size(response)
+            if response.status == 416:
+                # Probably an empty file.
+                response.read()
+                size = None
+            else:
+                _check_status(response, (200, 206))
+                if response.status == 200:
+                    # Server ignored range; use this response as the stream.
+                    self._single(response)
+                    return headers
+                # Size may be unknown (`bytes 0-0/*`): get without range.
+                response.read()
+                validator = _validator(response)
+        if size is None:
+            with self.pool.request(self.url) as response:
+                _check_status(response, (200,))
+                self._single(response)
+                return response.headers
+        self.total = size
+        journal = Journal.load(self.journal_path, self.url, size, validator)
+        if journal is None or not os.path.exists(self.part_path):
+            nsegments = max(1, min(self.segments, size // MIN_SEGMENT_SIZE))
+            journal = Journal.new(self.journal_path, self.url, size,
+                                  validator, nsegments)
+        else:
+            logging.info('Resuming: %s', self.part_path)
+        self.done = journal.done()
+        fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            preallocate(fd, size)
+            todo = [x for x in journal.segments if x[1] < x[2]]
+            try:
+                with ThreadPoolExecutor(max_workers=len(todo) or 1) as ex:
+                    futures = [ex.submit(self._segment, fd, journal, x)
+                               for x in todo]
+                    try:
+                        for future in futures:
+                            future.result()
+                    except BaseException:
+                        # Also on KeyboardInterrupt: don't wait for the rest.
+                        self.stop.set()
+                        for future in futures:
+                            future.cancel()
+                        raise
+            finally:
+                with journal.lock:
+                    journal.save()
+        finally:
+            os.close(fd)
+        os.remove(self.journal_path)
+        self._finish()
+        return headers
+
+    def _segment(self, fd, journal, segment):
+        """Fetch a segment, retrying from where it got to."""
+        for attempt in range(RETRIES + 1):
+            _, pos, end = segment
+            headers = {'Range': f'bytes={pos}-{end - 1}'}
+            if journal.validator:
+                headers['If-Range'] = journal.validator
+            try:
+                with self.pool.request(self.url, headers) as response:
+                    if response.status == 200:
+                        raise RemoteFileChanged(self.url, None)
+                    _check_status(response, (206,))
+                    while pos < end:
+                        self._check_stop()
+                        data = response.read(min(CHUNK_SIZE, end - pos))
+                        if not data:
+                            raise urllib.error.ContentTooShortError(
+                                f'Got {pos} of {end} bytes', None)
+                        os.pwrite(fd, data, pos)
+                        pos += len(data)
+                        journal.advance(segment, len(data))
+                        self._progress(len(data))
+                    response.read()  # Let the connection be reused.
+                return
+            except (OSError, http.client.HTTPException) as e:
+                if (attempt == RETRIES or isinstance(
+                        e, (urllib.error.HTTPError, RemoteFileChanged,
+                            DownloadStopped))):
+                    raise
+                logging.debug('Retrying segment at %s: %s', pos, e)
+
+    def _single(self, response):
+        """Fetch whole file in one stream from a response."""
+        size = response.headers.get('Content-Length')
+        self.total = int(size) if size and size.isdigit() else -1
+        with open(self.part_path, 'wb') as fp:
+            if self.total > 0:
+                preallocate(fp.fileno(), self.total)
+            try:
+                while True:
+                    self._check_stop()
+                    data = response.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    fp.write(data)
+                    self._progress(len(data))
+            except DownloadStopped:
+                raise
+            except (OSError, http.client.HTTPException) as e:
+                raise urllib.error.URLError(e) from e
+            fp.truncate()
+        if self.total >= 0 and self.done < self.total:
+            raise urllib.error.ContentTooShortError(
+                f'Got {self.done} of {self.total} bytes', None)
+        self._finish()
+
+    def _retrieve(self):
+        """Fetch with `urllib.request`. Return headers."""
+        request = urllib.request.Request(self.url,
+                                         headers={'User-Agent': USER_AGENT})
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            self.url = response.url
+            self._single(response)
+            return response.headers
+
+    def _finish(self):
+        """Move finished part file to destination."""
+        shutil.move(self.part_path, self.dst_path)
+
+
+def fetch(url, dst_path, part_path=None, segments=SEGMENTS, pool=None,
+          callback=None, stop=None):
+    """Download url to dst_path; see module docstring. Return headers."""
+    return Fetch(url, dst_path, part_path=part_path, segments=segments,
+                 pool=pool, callback=callback, stop=stop).run()
@@ -3,11 +3,13 @@
 import logging
 import os
 import shlex
-import shutil
-import urllib
+import sys
+import urllib.error
+import urllib.parse
 from pathlib import PurePath
 
-from ..misc import fmt_size, truncate
+from ..progress import Progress
+from .fetch import fetch
 
 
 def url_suffix(url):
@@ -22,39 +24,30 @@ def url_suffix(url):
     return suffix
 
 
-def download(url, dst_path, tmp_path=None, progress=True):
-    """Download file, showing optional progress meter."""
-    # TODO: Use newer py3 libs.
-    # TODO: Use notifications: notify-send -h int:value:42 "Working ..."
-    def report(cnt, blksize, total):
-        """Reporter callback."""
-        d = dict(d=truncate(os.fspath(dst_path), reserved=15))
-        if total == 0:
-            s = 'Download seems to be empty: %s'
-            try:
-                quoted = shlex.quote(os.fspath(dst_path))
-            except TypeError as e:
-                quoted = f'[{str(e)}, {type(dst_path)}]'
-            logging.warning(s, quoted)
-            total = -1
-        if total == -1:
-            s = '\r{d}: {p} '
-            d.update(p=fmt_size(cnt * blksize))
-        else:
-            s = '\r{d}: {t} {p:.0%} '
-            d.update(t=fmt_size(total), p=min(cnt * blksize / total, 1))
-        print(s.format(**d), end='', flush=True)
-        # print(set_term_title(s[1:].format(**d)), end='', flush=True)
+def download(url, dst_path, tmp_path=None, progress=True, title=False,
+             notify=False):
+    """Download file, showing optional progress meter.
 
-    d = {}
-    if tmp_path is not None:
-        d['filename'] = tmp_path
+    See `fetch.fetch()`; an interrupted download is resumed on the next call
+    with the same `tmp_path` (default: destination with suffix `.part`). With
+    progress, it can also be shown in terminal `title` and as desktop
+    notifications (`notify`).
+    """
+    meter = None
     if progress:
-        d['reporthook'] = report
+        meter = Progress(os.fspath(dst_path), stream=sys.stdout, title=title,
+                         notify=notify)
+    message = ''
     try:
-        filename, headers = urllib.request.urlretrieve(url, **d)
+        try:
+            headers = fetch(url, dst_path, part_path=tmp_path,
+                            callback=None if meter is None else meter.update)
+            message = 'OK'
+        finally:
+            if meter is not None:
+                meter.close(message)
     except urllib.error.ContentTooShortError as e:
-        # Didn't get all that was advertised.
+        # Didn't get all that was advertised; can be resumed.
         logging.error('%s: %s', e, url)
         return None
     except urllib.error.HTTPError as e:
@@ -69,10 +62,8 @@ def download(url, dst_path, tmp_path=None, progress=True):
         # Whatever this is... swith to py3 libs.
         logging.exception('%s: %s', e, url)
         return None
-    else:
-        shutil.move(filename, dst_path)
-        if progress:
-            print('OK')
-    finally:
-        urllib.request.urlcleanup()
+    if headers.get('Content-Length') == '0' or (
+            headers.get('Content-Range', '').endswith('/0')):
+        s = 'Download seems to be empty: %s'
+        logging.warning(s, shlex.quote(os.fspath(dst_path)))
     return headers
@@ -2,8 +2,14 @@
 
 """Scrape web."""
 
+import codecs
+import http.client
+import json
 import logging
-from functools import lru_cache
+import sys
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cached_property
 from http import HTTPStatus
 from urllib.request import urlopen
 # import urllib3
@@ -11,20 +17,86 @@ from urllib.request import urlopen
 
 from bs4 import BeautifulSoup
 import click
+from lxml import etree
+
+from .fetch import ConnectionPool
 
 # PARSER = 'html.parser'
 PARSER = 'lxml'
 # PARSER = 'lxml-xml'
 # PARSER = 'html5lib'
+CHUNK_SIZE = 2**14
+DRAIN_SIZE = 2**16  # Read at most this much of the rest to keep connection.
+HEAD_LIMIT = 2**20  # Give up looking for end of head after this much.
+PAGE_LIMIT = 2**23  # Don't look for hyperlinks in larger documents.
+
+
+class Head():
+    """What is in the document head: title, base, meta and link elements.
+
+    Made by `parse_head()`. If the end of head was not seen, `complete` is
+    false, and the lists may be missing something.
+    """
+
+    # Attributes that BeautifulSoup splits into lists.
+    multi_valued = ('class', 'accesskey', 'dropzone', 'rel', 'rev')
+
+    def __init__(self):
+        self.title = None
+        self.base = None
+        self.meta = []
+        self.links = []
+        self.complete = False
+
+    def add(self, el):
+        """Add a finished element."""
+        if el.tag == 'title' and self.title is None:
+            self.title = el.text or ''
+        elif el.tag == 'base' and self.base is None:
+            self.base = el.get('href')
+        elif el.tag == 'meta':
+            self.meta.append(dict(el.attrib))
+        elif el.tag == 'link':
+            d = {k: v.split() if k in self.multi_valued else v
+                 for k, v in el.attrib.items()}
+            self.links.append(d)
+
+
+def parse_head(chunks, encoding=None):
+    """Feed chunks to an incremental parser until the end of head.
+
+    Return a Head. The chunks iterator is not read further than needed.
+    """
+    head = Head()
+    parser = etree.HTMLPullParser(events=('start', 'end'), encoding=encoding)
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, el in parser.read_events():
+            if event == 'end' and el.tag != 'head':
+                head.add(el)
+            elif el.tag in ('head', 'body') and (
+                    event == 'end' or el.tag == 'body'):
+                head.complete = True
+                return head
+    return head
 
 
 class Scrappy():
-    """Scraper utility."""
+    """Scraper utility.
+
+    The response is read lazily: title and links only up to the end of the
+    document head, and the whole document only when the soup is needed. A
+    response opened elsewhere (e.g. from a connection pool) may be given.
+    """
 
-    def __init__(self, url, parser=PARSER):
+    def __init__(self, url, parser=PARSER, response=None):
         self._url = url
-        self._response = urlopen(url)
-        self._soup = BeautifulSoup(self._response, parser)
+        self._parser = parser
+        self._response = urlopen(url) if response is None else response
+        self._data = bytearray()
+        self._complete = False
+        self._soup = None
+        self._head = None
 
     @property
     def url(self):
@@ -34,8 +106,7 @@ class Scrappy():
     def real_url(self):
         return self._response.geturl()
 
-    @property
-    @lru_cache(maxsize=None)
+    @cached_property
     def code(self):
         """Get HTTP status code, or None on unknown code."""
         try:
@@ -44,30 +115,186 @@ class Scrappy():
         except ValueError:
             return None
 
-    @property
-    @lru_cache(maxsize=None)
+    @cached_property
     def info(self):
         """Get connection response info."""
         return self._response.info().items()
 
+    def _charset(self):
+        """Get charset from Content-Type, or None if missing or unknown."""
+        charset = self._response.info().get_content_charset()
+        if charset is None:
+            return None
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            logging.debug('Unknown charset: %s: %s', charset, self._url)
+            return None
+
+    def _read(self, size=CHUNK_SIZE):
+        """Read more of the body into buffer, return the new chunk."""
+        if self._complete:
+            return b''
+        chunk = self._response.read(size)
+        if chunk:
+            self._data += chunk
+        else:
+            self._complete = True
+        return chunk
+
+    def read(self):
+        """Read and return the whole body."""
+        while self._read(2**20):
+            pass
+        return bytes(self._data)
+
+    def drain(self, limit=DRAIN_SIZE):
+        """Read rest of the body if small, so the connection can be reused.
+
+        Return True if the body was read to the end.
+        """
+        length = self._response.getheader('Content-Length')
+        if length is None or not length.isdigit() or (
+                int(length) - len(self._data) > limit):
+            return self._complete
+        self.read()
+        return True
+
     @property
-    @lru_cache(maxsize=None)
+    def soup(self):
+        """Get document soup, parsing the whole document on first use."""
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.read(), self._parser)
+        return self._soup
+
+    def _chunks(self):
+        """Yield buffered data, then more of the body as it is read."""
+        if self._data:
+            yield bytes(self._data)
+        while len(self._data) < HEAD_LIMIT:
+            chunk = self._read()
+            if not chunk:
+                return
+            yield chunk
+
+    def head(self):
+        """Get Head, reading only until the end of document head."""
+        if self._head is None:
+            try:
+                self._head = parse_head(self._chunks(),
+                                        encoding=self._charset())
+            except LookupError as e:
+                # Known to Python, but not to lxml: let it guess.
+                logging.debug('%s: %s', e, self._url)
+                self._head = parse_head(self._chunks())
+        return self._head
+
+    @cached_property
     def title(self):
-        """Get document title."""
-        title = self._soup.title
-        if title is None:
-            return None
-        return title.string.strip()
+        """Get document title, from head if the soup is not there yet."""
+        if self._soup is not None:
+            title = self._soup.title
+            if title is None or title.string is None:
+                return None
+            return title.string.strip()
+        title = self.head().title
+        return None if title is None else title.strip()
 
     def links(self):
-        """Get links."""
-        # tags = self._soup.find_all()
-        tags = self._soup.find_all('link')
+        """Get links.
+
+        Taken from the document head, unless its end was not found; then the
+        whole document is parsed.
+        """
+        if self._soup is None and self.head().complete:
+            for d in self.head().links:
+                d = dict(d)
+                href = d.pop('href', '-')
+                yield href, d
+            return
+        # tags = self.soup.find_all()
+        tags = self.soup.find_all('link')
         for tag in tags:
             d = tag.attrs
             href = d.pop('href', '-')
             yield href, d
 
+    def anchors(self):
+        """Get absolute URLs of hyperlinks (`<a href>`)."""
+        base = self.real_url
+        for tag in self.soup.find_all('a', href=True):
+            url, _ = urllib.parse.urldefrag(
+                urllib.parse.urljoin(base, tag['href']))
+            if url.startswith(('http://', 'https://')):
+                yield url
+
+
+def _is_html(response):
+    """Does response look like HTML?"""
+    content_type = response.getheader('Content-Type', 'text/html')
+    return 'html' in content_type
+
+
+def _is_large(response):
+    """Is response body known to be larger than PAGE_LIMIT?"""
+    length = response.getheader('Content-Length', '')
+    return length.isdigit() and int(length) > PAGE_LIMIT
+
+
+def scrape(url, pool, follow=False):
+    """Fetch page over pool. Return page info dict and its hyperlinks."""
+    d = dict(url=url)
+    anchors = []
+    try:
+        with pool.request(url) as response:
+            scr = Scrappy(url, response=response)
+            d.update(real_url=scr.real_url, status=response.status,
+                     content_type=response.getheader('Content-Type'))
+            if _is_html(response) and response.status < 400:
+                d['title'] = scr.title
+                if follow and not _is_large(response):
+                    anchors = list(scr.anchors())
+            scr.drain()
+    except (OSError, http.client.HTTPException, etree.Error,
+            ValueError) as e:
+        d['error'] = str(e)
+    return d, anchors
+
+
+def crawl(urls, depth=0, workers=16, same_host=True):
+    """Scrape pages concurrently over pooled connections, yield info dicts.
+
+    Hyperlinks are followed breadth-first up to `depth` steps, by default
+    only within the host of the page they are on. Each page is visited once.
+    """
+    pool = ConnectionPool(maxsize=workers)
+    seen = set()
+    level = []
+    for url in urls:
+        if url not in seen:
+            seen.add(url)
+            level.append(url)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for i in range(depth + 1):
+                follow = i < depth
+                futures = {executor.submit(scrape, x, pool, follow): x
+                           for x in level}
+                level = []
+                for future in as_completed(futures):
+                    d, anchors = future.result()
+                    d['depth'] = i
+                    yield d
+                    host = urllib.parse.urlsplit(futures[future]).netloc
+                    for url in anchors:
+                        if url in seen or (same_host and host !=
+                                           urllib.parse.urlsplit(url).netloc):
+                            continue
+                        seen.add(url)
+                        level.append(url)
+    finally:
+        pool.close()
+
 
 @click.command()
 @click.argument('url')
@@ -99,3 +326,20 @@ def cli(url, verbose, response, links):
         for i, (href, d) in enumerate(scr.links()):
             # echo('{:4}: {}: {}'.format(i, href, d))
             echo(f'{i:4}: {href}: {d}')
+
+
+@click.command()
+@click.argument('urls', nargs=-1)
+@click.option('-d', '--depth', type=int, default=0, show_default=True,
+              help='Follow hyperlinks this deep')
+@click.option('-a', '--any-host', is_flag=True,
+              help='Follow hyperlinks to other hosts, too')
+@click.option('-j', '--jobs', type=int, default=16, show_default=True,
+              help='Number of simultaneous requests')
+def cli_crawl(urls, depth, any_host, jobs):
+    """Scrape URLs (or those read from stdin), print JSON lines."""
+    if not urls:
+        urls = [x.strip() for x in sys.stdin if x.strip()]
+    for d in crawl(urls, depth=depth, workers=jobs,
+                   same_host=not any_host):
+        click.echo(json.dumps(d, ensure_ascii=False))
@@ -0,0 +1,201 @@
+"""Progress display for transfers.
+
+Updating progress only bumps counters; the status line is rendered at most
+at a fixed rate, so frequent small updates cost next to nothing. Throughput
+is estimated over a rolling time window, and the remaining time from that.
+"""
+
+import logging
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+
+from .misc import fmt_size, notify_send, set_term_title, truncate
+
+
+def fmt_duration(seconds):
+    """Format seconds as [h:]mm:ss."""
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    if h:
+        return f'{h}:{m:02}:{s:02}'
+    return f'{m:02}:{s:02}'
+
+
+class Progress:
+    """Progress of a transfer of bytes, and optionally of items (files).
+
+    The line goes to `stream`, redrawn at most every `interval` seconds.
+    With `title`, it is mirrored to the terminal title; with `notify`, it is
+    sent as a desktop notification progress hint every `notify_interval`
+    seconds, without waiting for it to be shown. Safe to update from several
+    threads.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, label='', total=-1, items=None, interval=0.1,
+                 window=5.0, stream=None, title=False, notify=False,
+                 notify_interval=2.0):
+        """Init. Total is -1 if unknown."""
+        self.done = 0
+        self.total = total
+        self.items = items
+        self.items_done = 0
+        self.items_failed = 0
+        self.interval = interval
+        self.window = window
+        self.stream = sys.stderr if stream is None else stream
+        self.title = title
+        self.notify = notify
+        self.notify_interval = notify_interval
+        self.columns = shutil.get_terminal_size().columns
+        self.label = truncate(label, reserved=40, columns=self.columns)
+        self.lock = threading.Lock()
+        self.notify_lock = threading.Lock()
+        self.notifier = None  # Running notify-send process.
+        self.start = time.monotonic()
+        self.samples = deque([(self.start, 0)])
+        self.next_render = self.start
+        self.next_notify = self.start
+        self.width = 0
+
+    def add(self, n):
+        """Add n bytes done."""
+        with self.lock:
+            self.done += n
+            notification = self._tick()
+        self._notify(notification)
+
+    def update(self, done, total=None):
+        """Set bytes done, and total if known. Usable as a fetch callback."""
+        with self.lock:
+            if len(self.samples) == 1 and not self.done:
+                # Resumed transfer: don't count earlier bytes in rate.
+                self.samples[0] = time.monotonic(), done
+            self.done = done
+            if total is not None:
+                self.total = total
+            notification = self._tick()
+        self._notify(notification)
+
+    def add_total(self, n):
+        """Add n bytes to total, e.g. when a new file's size gets known."""
+        with self.lock:
+            self.total = max(self.total, 0) + n
+
+    def item_done(self, failed=False):
+        """Count an item done."""
+        with self.lock:
+            self.items_done += 1
+            self.items_failed += failed
+            notification = self._tick()
+        self._notify(notification)
+
+    def _tick(self):
+        """Render if it is time, with lock held. See `_render()`."""
+        now = time.monotonic()
+        if now >= self.next_render:
+            self.next_render = now + self.interval
+            return self._render(now)
+        return None
+
+    def rate(self, now=None):
+        """Return bytes per second over the rolling window."""
+        if now is None:
+            now = time.monotonic()
+        t, done = self.samples[0]
+        if now - t < 1e-9:
+            return 0.0
+        return (self.done - done) / (now - t)
+
+    def eta(self, now=None):
+        """Return estimated seconds left, or None if unknown."""
+        rate = self.rate(now)
+        if self.total < 0 or rate <= 0:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def line(self, now=None):
+        """Return status line."""
+        if now is None:
+            now = time.monotonic()
+        parts = []
+        if self.label:
+            parts.append(f'{self.label}:')
+        if self.items is not None:
+            parts.append(f'{self.items_done}/{self.items}')
+        if self.total >= 0:
+            parts.append(f'{fmt_size(self.done)}/{fmt_size(self.total)}')
+            if self.total:
+                parts.append(f'{min(self.done / self.total, 1):.0%}')
+        else:
+            parts.append(fmt_size(self.done))
+        parts.append(fmt_size(self.rate(now), unit='B/s'))
+        eta = self.eta(now)
+        if eta is not None:
+            parts.append(f'ETA {fmt_duration(eta)}')
+        if self.items_failed:
+            parts.append(f'{self.items_failed} failed')
+        return ' '.join(parts)
+
+    def _render(self, now, end=''):
+        """Draw status line, with lock held.
+
+        Return a notification to send after releasing the lock, or None.
+        """
+        self.samples.append((now, self.done))
+        while len(self.samples) > 2 and now - self.samples[1][0] > self.window:
+            self.samples.popleft()
+        line = self.line(now)
+        pad = ' ' * max(self.width - len(line), 0)
+        self.width = len(line)
+        if self.title:
+            print(set_term_title(line), end='', file=self.stream)
+        print(f'\r{line}{pad}', end=end, file=self.stream, flush=True)
+        if self.notify and (now >= self.next_notify or end):
+            self.next_notify = now + self.notify_interval
+            percent = None
+            if self.total > 0:
+                percent = min(100 * self.done // self.total, 100)
+            return line, percent, bool(end)
+        return None
+
+    def _notify(self, notification):
+        """Start sending notification, disabling them on failure.
+
+        It is skipped if the previous one is still being sent, unless final.
+        """
+        if notification is None or not self.notify_lock.acquire(False):
+            return
+        line, percent, final = notification
+        try:
+            if self.notifier is not None:
+                status = self.notifier.poll()
+                if status is None and not final:
+                    return
+                if status:
+                    raise OSError(f'notify-send failed with status {status}')
+            tag = 'string', 'x-dunst-stack-tag', f'progress-{id(self)}'
+            self.notifier = notify_send(self.label or 'Progress', line,
+                                        progress=percent, hints=[tag],
+                                        wait=False)
+        except OSError as e:
+            logging.debug('Disabling notifications: %s', e)
+            self.notify = False
+        finally:
+            self.notify_lock.release()
+
+    def close(self, message=''):
+        """Draw final status line, followed by message and newline."""
+        with self.lock:
+            end = f' {message}\n' if message else '\n'
+            notification = self._render(time.monotonic(), end=end)
+        self._notify(notification)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
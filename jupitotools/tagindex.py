@@ -0,0 +1,304 @@
+"""Inverted index of tags stored as TagDict strings in extended attributes.
+
+Each indexed file gets a small integer id. For each tag key, and for each
+key-value pair, the index keeps a bitmap (a Python int, bit i set for file
+id i) of the files having it. Queries are bitwise operations on these.
+
+Query syntax: comma-separated terms that must all match; a term is a key
+(`seen`) or a key-value pair (`genre=jazz`), optionally prefixed with `!` to
+negate it, and alternatives can be separated by `|` (`genre=jazz|genre=soul`).
+"""
+
+import logging
+import os
+import pickle
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+from stat import S_ISDIR, S_ISREG
+
+import click
+
+from .files import ensure_dir
+from .misc import TagDict
+
+XATTR_KEY = 'user.xdg.tags'
+INDEX_NAME = 'index.pickle'
+INDEX_VERSION = 1
+
+
+def _term(key, value=None):
+    """Return index term for key, or key-value pair."""
+    if value is None:
+        return key
+    return f'{key}{TagDict.key_sep}{value}'
+
+
+def bit_ids(bits):
+    """Return list of indices of set bits in an int."""
+    s = bin(bits)[:1:-1]
+    ids = []
+    i = s.find('1')
+    while i >= 0:
+        ids.append(i)
+        i = s.find('1', i + 1)
+    return ids
+
+
+def bitmap(ids):
+    """Return int with bits of ids set, built at once."""
+    if not ids:
+        return 0
+    buf = bytearray((max(ids) >> 3) + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, 'little')
+
+
+class TagIndex:
+    """Persistent inverted index of file tags.
+
+    File entries are refreshed when their change time (which, unlike the
+    modification time, changes also on attribute updates) differs from the
+    indexed one.
+    """
+
+    def __init__(self, path=None, xattr_key=XATTR_KEY):
+        """Init, and load index file if given."""
+        self.path = None if path is None else Path(path)
+        self.xattr_key = xattr_key
+        self.paths = []  # File path by id; None for a free id.
+        self.ids = {}  # File id by path.
+        self.stamps = []  # Change time by id.
+        self.records = []  # Tag record by id.
+        self.postings = {}  # Bitmap by term.
+        self.live = 0  # Bitmap of used ids.
+        self.free = []  # Free ids.
+        self.dirty = False
+        if self.path is not None:
+            self.load()
+
+    def load(self):
+        """Load index file."""
+        # pylint: disable=broad-except
+        try:
+            with self.path.open('rb') as fp:
+                version, xattr_key, state = pickle.load(fp)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.debug('Ignoring index %s: %s', self.path, e)
+            return
+        if (version, xattr_key) == (INDEX_VERSION, self.xattr_key):
+            (self.paths, self.stamps, self.records, self.postings,
+             self.live) = state
+            self.ids = {x: i for i, x in enumerate(self.paths)
+                        if x is not None}
+            self.free = [i for i, x in enumerate(self.paths) if x is None]
+
+    def save(self):
+        """Save index file if changed."""
+        if not self.dirty or self.path is None:
+            return
+        state = (self.paths, self.stamps, self.records, self.postings,
+                 self.live)
+        ensure_dir(self.path)
+        with tempfile.NamedTemporaryFile(dir=self.path.parent,
+                                         prefix=self.path.name,
+                                         delete=False) as fp:
+            try:
+                pickle.dump((INDEX_VERSION, self.xattr_key, state), fp,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+                fp.close()
+                os.replace(fp.name, self.path)
+            finally:
+                if os.path.exists(fp.name):
+                    os.remove(fp.name)
+        self.dirty = False
+
+    def _terms(self, record):
+        """Yield index terms of a tag record."""
+        for key, value in record:
+            yield _term(key)
+            if value is not None:
+                yield _term(key, value)
+
+    def _set_records(self, records):
+        """Replace tag records by file id, updating each posting once.
+
+        Setting bits one by one would copy the growing bitmaps for each file.
+        """
+        removed, added = defaultdict(list), defaultdict(list)
+        for i, record in records.items():
+            for term in set(self._terms(self.records[i])):
+                removed[term].append(i)
+            for term in set(self._terms(record)):
+                added[term].append(i)
+            self.records[i] = record
+        for term, ids in removed.items():
+            bits = self.postings[term] & ~bitmap(ids)
+            if bits:
+                self.postings[term] = bits
+            else:
+                del self.postings[term]
+        for term, ids in added.items():
+            self.postings[term] = self.postings.get(term, 0) | bitmap(ids)
+        if records:
+            self.dirty = True
+
+    def _add(self, path):
+        """Add path without tags, return its id. Not yet marked live."""
+        if self.free:
+            i = self.free.pop()
+            self.paths[i] = path
+        else:
+            i = len(self.paths)
+            self.paths.append(path)
+            self.stamps.append(None)
+            self.records.append(())
+        self.ids[path] = i
+        return i
+
+    def remove(self, path):
+        """Remove path from index."""
+        self.remove_many([path])
+
+    def remove_many(self, paths):
+        """Remove paths from index."""
+        ids = [self.ids.pop(x) for x in paths]
+        self._set_records(dict.fromkeys(ids, ()))
+        for i in ids:
+            self.paths[i] = None
+            self.stamps[i] = None
+        self.live &= ~bitmap(ids)
+        self.free.extend(ids)
+
+    def _read_tags(self, path):
+        """Read tag record of file, or empty if none."""
+        try:
+            s = os.getxattr(path, self.xattr_key).decode('utf-8')
+        except OSError:
+            return ()
+        except UnicodeDecodeError as e:
+            logging.warning('Invalid tags: %s: %s', path, e)
+            return ()
+        if not s.strip():
+            return ()
+        return TagDict.parse(s)
+
+    def update_file(self, path, st=None):
+        """Index a file, if it has changed."""
+        path = os.fspath(path)
+        if st is None:
+            st = os.stat(path)
+        return bool(self.update_files([(path, st)]))
+
+    def update_files(self, files):
+        """Index `(path, stat_result)` pairs whose files have changed.
+
+        Return the number of updated files.
+        """
+        records, new = {}, []
+        for path, st in files:
+            i = self.ids.get(path)
+            if i is None:
+                i = self._add(path)
+                new.append(i)
+            elif self.stamps[i] == st.st_ctime_ns:
+                continue
+            records[i] = self._read_tags(path)
+            self.stamps[i] = st.st_ctime_ns
+        self._set_records(records)
+        self.live |= bitmap(new)
+        return len(records)
+
+    def update(self, paths):
+        """Index files under paths, and forget files removed from there.
+
+        Only files whose change time differs are read. Return the numbers of
+        updated and removed files.
+        """
+        roots = [os.path.abspath(x) for x in paths]
+        files = {}
+        stack = list(roots)
+        while stack:
+            path = stack.pop()
+            try:
+                st = os.stat(path, follow_symlinks=False)
+                if S_ISDIR(st.st_mode):
+                    with os.scandir(path) as it:
+                        stack.extend(x.path for x in it)
+                elif S_ISREG(st.st_mode):
+                    files[path] = st
+            except OSError as e:
+                logging.warning('Cannot index: %s: %s', path, e)
+        nupdated = self.update_files(files.items())
+        prefixes = tuple(os.path.join(x, '') for x in roots)
+        gone = [x for x in self.ids if x not in files and
+                (x in roots or x.startswith(prefixes))]
+        self.remove_many(gone)
+        return nupdated, len(gone)
+
+    def bits(self, term):
+        """Return bitmap of a single query term, without `!` or `|`."""
+        key, sep, value = term.partition(TagDict.key_sep)
+        key = TagDict.normalize_key(key)
+        return self.postings.get(_term(key, value if sep else None), 0)
+
+    def query_bits(self, query):
+        """Return bitmap of files matching a query string."""
+        result = self.live
+        for term in query.split(TagDict.tag_sep):
+            term = term.strip()
+            if not term:
+                continue
+            negate = term.startswith('!')
+            if negate:
+                term = term[1:]
+            bits = 0
+            for alternative in term.split('|'):
+                bits |= self.bits(alternative)
+            if negate:
+                result &= ~bits
+            else:
+                result &= bits
+        return result
+
+    def query(self, query):
+        """Return paths of files matching a query string, in id order."""
+        return [self.paths[i] for i in bit_ids(self.query_bits(query))]
+
+    def count(self, query):
+        """Return number of files matching a query string."""
+        return bin(self.query_bits(query)).count('1')
+
+    def __len__(self):
+        return len(self.ids)
+
+
+@click.command()
+@click.argument('query', required=False)
+@click.option('-u', '--update', 'update_paths', multiple=True,
+              type=click.Path(exists=True),
+              help='Index files under path first (repeatable)')
+@click.option('-i', '--index', 'index_path', type=click.Path(),
+              help='Index file')
+@click.option('-k', '--key', default=XATTR_KEY, show_default=True,
+              help='Extended attribute holding the tags')
+@click.option('-c', '--count', is_flag=True, help='Only count matches')
+def cli_tagindex(query, update_paths, index_path, key, count):
+    """Query tags of indexed files, e.g. 'genre=jazz,!seen'."""
+    if index_path is None:
+        index_path = Path(click.get_app_dir('tagindex')) / INDEX_NAME
+    index = TagIndex(index_path, xattr_key=key)
+    if update_paths:
+        nupdated, nremoved = index.update(update_paths)
+        logging.info('Updated %d, removed %d', nupdated, nremoved)
+        index.save()
+    if query is None:
+        return
+    if count:
+        print(index.count(query))
+    else:
+        for path in index.query(query):
+            print(path)
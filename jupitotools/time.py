@@ -1,12 +1,26 @@
 """Time and date related stuff."""
 
+import calendar
 import datetime
 import sys
-from functools import lru_cache
+from time import mktime
 
 import dateutil.easter
 import dateutil.parser
 
+# Movable feasts as days from (Western) Easter.
+EASTER_OFFSETS = dict(
+    good_friday=-2,
+    easter=0,
+    easter_monday=1,
+    ascension=39,
+    pentecost=49,
+    )
+FEASTS = tuple(EASTER_OFFSETS) + ('midsummer',)
+
+_EASTER = {}  # Year -> Easter date.
+_FEASTS = {}  # Year -> {feast name -> date}.
+
 
 class DateMixin:
     """Date mixin."""
@@ -33,21 +47,21 @@ class DateMixin:
 
     def isoweekyear(self):
         """Return the ISO 8601 week-based year (i.e. year starts on Monday)."""
-        return int(self.strftime('%G'))
+        return self.isocalendar()[0]
 
     def yearday(self):
         """Return the day of the year."""
-        return int(self.strftime('%j'))
+        return self.toordinal() - _days_before_year(self.year)
 
     def posixday(self):
         """POSIX timestamp day."""
-        return int(Datetime.fromdatelike(self).timestamp() / 60**2 / 24)
+        return _posixday(self.year, self.month, self.day)
 
     def tomorrow(self, days=1):
         """Shift by days."""
-        # Just modifying the `day` variable fails when months change.
-        o = self.fromordinal(self.toordinal() + days)
-        return self.replace(year=o.year, month=o.month, day=o.day)
+        # Just modifying the `day` variable fails when months change. Adding
+        # a timedelta keeps the class, and time fields if any.
+        return self + datetime.timedelta(days=days)
 
     def this_monday(self):
         """Return this week's monday."""
@@ -57,12 +71,11 @@ class DateMixin:
         """Return next week's monday."""
         return self + datetime.timedelta(days=-self.weekday(), weeks=1)
 
-    @lru_cache
     def easter(self, year=None):
         """Return the date of (Western) Easter."""
         if year is None:
             year = self.year
-        return dateutil.easter.easter(year)
+        return easter(year)
 
 
 class TimeMixin:
@@ -121,6 +134,102 @@ class Timedelta(datetime.timedelta):
         return f'{hours}:{mins:02}'
 
 
+def fill_feast_tables(start, stop):
+    """Compute Easter and movable feasts for a range of years in bulk."""
+    for year in range(start, stop):
+        if year in _FEASTS:
+            continue
+        e = Date.fromdatelike(dateutil.easter.easter(year))
+        d = {k: e + datetime.timedelta(days=v) for k, v in
+             EASTER_OFFSETS.items()}
+        # Finnish Midsummer Day is the Saturday between June 20 and 26.
+        june20 = Date(year, 6, 20)
+        d['midsummer'] = june20 + datetime.timedelta(
+            days=(5 - june20.weekday()) % 7)
+        _EASTER[year] = e
+        _FEASTS[year] = d
+
+
+def easter(year):
+    """Return the date of (Western) Easter for year, from a table."""
+    try:
+        return _EASTER[year]
+    except KeyError:
+        fill_feast_tables(year, year + 1)
+        return _EASTER[year]
+
+
+def feasts(year):
+    """Return movable feasts for year as a dict, name to date, from a table.
+
+    See `FEASTS` for the names. Do not modify the returned dict.
+    """
+    try:
+        return _FEASTS[year]
+    except KeyError:
+        fill_feast_tables(year, year + 1)
+        return _FEASTS[year]
+
+
+def date_fields(start, stop):
+    """Return date fields for a range of Gregorian ordinals at once.
+
+    This is like calling the corresponding `Date` methods for each ordinal in
+    `range(start, stop)`, but no date objects are created: integer counters
+    are stepped from day to day. Return a dict of lists with keys `year`,
+    `month`, `day`, `isoweekday`, `isoweek`, `isoweekyear`, `yearday`, and
+    `posixday`.
+    """
+    first = datetime.date.fromordinal(start)
+    y, m, d = first.year, first.month, first.day
+    wy, wk, wd = first.isocalendar()
+    yd = start - _days_before_year(y)
+    month_days = calendar.monthrange(y, m)[1]
+    year_weeks = _weeks_in_isoyear(wy)
+    fields = {k: [] for k in ['year', 'month', 'day', 'isoweekday', 'isoweek',
+                              'isoweekyear', 'yearday', 'posixday']}
+    appenders = [x.append for x in fields.values()]
+    for _ in range(start, stop):
+        pd = _posixday(y, m, d)
+        for append, value in zip(appenders, (y, m, d, wd, wk, wy, yd, pd)):
+            append(value)
+        d += 1
+        yd += 1
+        if d > month_days:
+            d = 1
+            m += 1
+            if m > 12:
+                m = 1
+                y += 1
+                yd = 1
+            month_days = calendar.monthrange(y, m)[1]
+        wd += 1
+        if wd > 7:
+            wd = 1
+            wk += 1
+            if wk > year_weeks:
+                wk = 1
+                wy += 1
+                year_weeks = _weeks_in_isoyear(wy)
+    return fields
+
+
+def _days_before_year(year):
+    """Number of days before January 1st of year."""
+    y = year - 1
+    return y * 365 + y // 4 - y // 100 + y // 400
+
+
+def _weeks_in_isoyear(year):
+    """Number of weeks in ISO 8601 week-based year."""
+    return datetime.date(year, 12, 28).isocalendar()[1]
+
+
+def _posixday(year, month, day):
+    """POSIX timestamp day of local midnight."""
+    return int(mktime((year, month, day, 0, 0, 0, 0, 0, -1)) / 60**2 / 24)
+
+
 def _asdict(obj, keys):
     return {k: getattr(obj, k) for k in keys}
 
@@ -0,0 +1,273 @@
+"""Bulk moving and copying of files, preserving times and extended attributes.
+
+Moves within a filesystem are done by `os.rename()`. Files on other
+filesystems are copied in a thread pool, in kernel space when possible
+(`os.copy_file_range()`, which may also share extents on filesystems like
+Btrfs or XFS, falling back to `os.sendfile()`, and then to plain reads and
+writes).
+"""
+
+import errno
+import logging
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from stat import S_ISDIR, S_ISLNK, S_IMODE
+
+import click
+
+from .files import ensure_dir
+from .misc import fmt_size
+
+CHUNK_SIZE = 2**30  # Maximum bytes per system call.
+BUFFER_SIZE = 2**20  # Bytes per read in the plain fallback.
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+                    errno.EBADF, errno.ENOTSUP}
+
+
+class TransferStats:
+    """Counters of a bulk transfer."""
+
+    def __init__(self):
+        """Init."""
+        self.start = time.monotonic()
+        self.renamed = 0
+        self.copied = 0
+        self.bytes = 0
+        self.failed = []
+
+    def elapsed(self):
+        """Return seconds since start."""
+        return time.monotonic() - self.start
+
+    def rate(self):
+        """Return copied bytes per second."""
+        return self.bytes / max(self.elapsed(), 1e-9)
+
+    def __str__(self):
+        return (f'{self.renamed} renamed, {self.copied} copied '
+                f'({fmt_size(self.bytes)} in {self.elapsed():.1f}s, '
+                f'{fmt_size(self.rate(), unit="B/s")}), '
+                f'{len(self.failed)} failed')
+
+
+def _copy_range(infd, outfd, done, size):
+    """Copy using `os.copy_file_range()` from offset done. Return new offset.
+
+    Stops early where not supported; the rest is then copied otherwise.
+    """
+    if not hasattr(os, 'copy_file_range'):
+        return done
+    while done < size:
+        try:
+            n = os.copy_file_range(infd, outfd, min(size - done, CHUNK_SIZE),
+                                   done, done)
+        except OSError as e:
+            if e.errno in _FALLBACK_ERRNOS:
+                break
+            raise
+        if n == 0:
+            break  # Some filesystems just copy nothing.
+        done += n
+    return done
+
+
+def _copy_sendfile(infd, outfd, done, size):
+    """Copy using `os.sendfile()` from offset done. Return new offset."""
+    os.lseek(outfd, done, os.SEEK_SET)
+    while done < size:
+        try:
+            n = os.sendfile(outfd, infd, done, min(size - done, CHUNK_SIZE))
+        except OSError as e:
+            if e.errno in _FALLBACK_ERRNOS:
+                break
+            raise
+        if n == 0:
+            break
+        done += n
+    return done
+
+
+def _copy_read(infd, outfd, done, size):
+    """Copy with plain reads and writes from offset done. Return new offset.
+    """
+    while done < size:
+        data = os.pread(infd, min(size - done, BUFFER_SIZE), done)
+        if not data:
+            break
+        done += os.pwrite(outfd, data, done)
+    return done
+
+
+def _copy_xattrs(infd, outfd, dst):
+    """Copy extended attributes between file descriptors where allowed."""
+    try:
+        keys = os.listxattr(infd)
+    except OSError as e:
+        logging.debug('Cannot list xattrs: %s', e)
+        return
+    for key in keys:
+        try:
+            os.setxattr(outfd, key, os.getxattr(infd, key))
+        except OSError as e:
+            logging.debug('Cannot copy xattr: %s: %s: %s', dst, key, e)
+
+
+def copy_file(src, dst, st=None):
+    """Copy regular file contents, mode, xattrs, and times. Return size.
+
+    Extended attributes that cannot be written (e.g. `security.*` as a
+    normal user) are skipped. If fewer bytes than the size in `st` could be
+    copied, OSError is raised.
+    """
+    src = os.fspath(src)
+    dst = os.fspath(dst)
+    if st is None:
+        st = os.stat(src)
+    infd = os.open(src, os.O_RDONLY)
+    try:
+        outfd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                        S_IMODE(st.st_mode))
+        try:
+            done = 0
+            for copy in (_copy_range, _copy_sendfile, _copy_read):
+                done = copy(infd, outfd, done, st.st_size)
+            if done != st.st_size:
+                raise OSError(errno.EIO, f'Copied {done} of {st.st_size} '
+                              'bytes', src)
+            os.fchmod(outfd, S_IMODE(st.st_mode))
+            _copy_xattrs(infd, outfd, dst)
+            os.utime(outfd, ns=(st.st_atime_ns, st.st_mtime_ns))
+        finally:
+            os.close(outfd)
+    finally:
+        os.close(infd)
+    return st.st_size
+
+
+def copy_path(src, dst):
+    """Copy a file, symlink, or directory tree. Return copied bytes."""
+    st = os.lstat(src)
+    if S_ISLNK(st.st_mode):
+        os.symlink(os.readlink(src), dst)
+        return 0
+    if S_ISDIR(st.st_mode):
+        total = 0
+
+        def copy_function(s, d):
+            nonlocal total
+            total += copy_file(s, d)
+
+        shutil.copytree(src, dst, symlinks=True, copy_function=copy_function)
+        return total
+    return copy_file(src, dst, st)
+
+
+def _copy_job(src, dst, move):
+    """Copy, and remove source if moving. Return copied bytes.
+
+    A short copy raises in `copy_file()`, so the source is kept then.
+    """
+    size = copy_path(src, dst)
+    if move:
+        if os.path.isdir(src) and not os.path.islink(src):
+            shutil.rmtree(src)
+        else:
+            os.remove(src)
+    return size
+
+
+def transfer(pairs, move=True, workers=4, callback=None):
+    """Move or copy many `(src, dst)` pairs. Return a TransferStats.
+
+    Destination parent directories are created as needed. When moving,
+    renaming is tried first; only pairs crossing filesystems are copied. The
+    copies are run in a thread pool of `workers`. Failures are logged and
+    collected in `stats.failed` as `(src, dst, exception)`. If given,
+    `callback(stats)` is called after each finished pair.
+    """
+    stats = TransferStats()
+    jobs = []
+    for src, dst in pairs:
+        src, dst = os.fspath(src), os.fspath(dst)
+        try:
+            ensure_dir(dst)
+            if move:
+                os.rename(src, dst)
+                stats.renamed += 1
+                if callback is not None:
+                    callback(stats)
+                continue
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                logging.warning('Cannot transfer: %s: %s', src, e)
+                stats.failed.append((src, dst, e))
+                continue
+        jobs.append((src, dst))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_copy_job, src, dst, move): (src, dst)
+                   for src, dst in jobs}
+        for future in as_completed(futures):
+            try:
+                stats.bytes += future.result()
+                stats.copied += 1
+            except OSError as e:
+                src, dst = futures[future]
+                logging.warning('Cannot transfer: %s: %s', src, e)
+                stats.failed.append((src, dst, e))
+            if callback is not None:
+                callback(stats)
+    return stats
+
+
+def read_pairs(fp):
+    """Read tab-separated `src<TAB>dst` lines.
+
+    Lines without exactly one tab, or with an empty path, are ambiguous;
+    they are skipped with a warning.
+    """
+    for i, line in enumerate(fp, 1):
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        src, _, dst = line.partition('\t')
+        if not src or not dst or '\t' in dst:
+            logging.warning('Invalid pair on line %i: %r', i, line)
+            continue
+        yield src, dst
+
+
+@click.command()
+@click.argument('paths', nargs=-1, type=click.Path())
+@click.option('-c', '--copy', is_flag=True, help='Copy instead of moving')
+@click.option('-f', '--pairs', 'pairs_file', type=click.File(),
+              help='Read tab-separated source-destination lines (- = stdin)')
+@click.option('-j', '--jobs', type=int, default=4, show_default=True,
+              help='Number of parallel copies')
+@click.option('-v', '--verbose', is_flag=True, help='Report progress')
+def cli_transfer(paths, copy, pairs_file, jobs, verbose):
+    """Move or copy SRC... to directory DST, or pairs given in a file."""
+    if pairs_file is not None:
+        pairs = list(read_pairs(pairs_file))
+    elif len(paths) >= 2:
+        dst = Path(paths[-1])
+        if len(paths) == 2 and not dst.is_dir():
+            pairs = [(Path(paths[0]), dst)]
+        else:
+            pairs = [(Path(x), dst / Path(x).name) for x in paths[:-1]]
+    else:
+        raise click.UsageError('Give SRC... DST or --pairs')
+
+    def callback(stats):
+        print(f'\r{stats}', end='', file=sys.stderr, flush=True)
+
+    stats = transfer(pairs, move=not copy, workers=jobs,
+                     callback=callback if verbose else None)
+    if verbose:
+        print(file=sys.stderr)
+    print(stats)
+    if stats.failed:
+        sys.exit(1)
@@ -38,9 +38,14 @@ setuptools.setup(
 [console_scripts]
 
 abbr-path = jupitotools.files:cli_abbr_path
+find-dupes = jupitotools.hashes:cli_find_dupes
+transfer = jupitotools.transfer:cli_transfer
+tagindex = jupitotools.tagindex:cli_tagindex
 
 scrappy = jupitotools.net.scrappy:cli
+scrappy-crawl = jupitotools.net.scrappy:cli_crawl
 scan-urls = jupitotools.net.url:cli_scan_urls
+fetch-many = jupitotools.net.batch:cli_fetch_many
 
 monday = jupitotools.time:cli_monday
 cute-hours = jupitotools.time:cli_cute_hours